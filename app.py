@@ -45,6 +45,7 @@ def fargate(config, stack_id):
         output_bucket_name=output_bucket_name,
         topics_to_extract=topics_to_extract,
         glue_db_name=config["glue-db-name"],
+        grid_interval_ns=config.get("grid-interval-ns"),
     )
 
     return fargate_stack
@@ -101,6 +102,8 @@ emr_orchestration_stack = StepFunctionStack(
     synchronized_bucket=emr_cluster_stack.synchronized_bucket,
     scenes_bucket=emr_cluster_stack.scenes_bucket,
     glue_db_name=config["fargate"]["glue-db-name"],
+    fuse_spark_steps=config.get("fuse-spark-steps", False),
+    grid_mode=bool(config["fargate"].get("grid-interval-ns")),
 )
 
 
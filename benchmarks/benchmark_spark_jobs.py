@@ -0,0 +1,319 @@
+"""
+Local benchmark harness for spark_scripts/synchronize_topics.py and spark_scripts/detect_scenes.py.
+
+Generates synthetic per-topic parquet in the bag_parquets layout, runs both jobs' main() on
+local-mode Spark against file:// paths, and records wall time plus per-stage time, shuffle and
+spill from the Spark UI REST API while sweeping the number of bags, bag length and topic count.
+
+    python benchmarks/benchmark_spark_jobs.py --num-bags 2,8 --bag-length-secs 30,300 --num-topics 3,9
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+from pyspark.sql import SparkSession
+import pyspark.sql.functions as func
+
+SPARK_SCRIPTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "spark_scripts"
+)
+sys.path.insert(0, SPARK_SCRIPTS_DIR)
+
+import detect_scenes  # noqa: E402
+import synchronize_and_detect  # noqa: E402
+import synchronize_topics  # noqa: E402
+from common import NANOS_PER_SEC  # noqa: E402
+
+DETECTIONS_TOPIC = "rgb_right_detections_only"
+LANES_TOPIC = "post_process_lane_points_rgb_front_right"
+BAG_START_NS = 1_608_047_300_000_000_000
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-bags", default="2")
+    parser.add_argument("--bag-length-secs", default="30")
+    parser.add_argument("--num-topics", default="3")
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--shuffle-partitions", type=int, default=8)
+    parser.add_argument(
+        "--prune-columns",
+        action="store_true",
+        help="Synchronize only the detector columns; by default every synthetic topic is synchronized",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Also time synchronize_and_detect.py, which hands the synchronized topics over in memory",
+    )
+    parser.add_argument("--work-dir", help="Directory for synthetic inputs and outputs")
+    parser.add_argument("--output", help="Append one JSON line per job run to this file")
+    return parser.parse_args(args=args)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def lane_payloads(num_variants=5):
+    """
+    A few lane sets with slightly shifted points, so lane payloads change between frames
+    """
+    payloads = []
+    for variant in range(num_variants):
+        lanes = [
+            {
+                "image_points": [
+                    {"x": float(x0 + variant + (y / 20)), "y": float(y)}
+                    for y in range(300, 720, 20)
+                ]
+            }
+            for x0 in (200, 500, 800, 1100)
+        ]
+        payloads.append(json.dumps(lanes))
+    return payloads
+
+
+def topic_frame(spark, topic, bag_length_secs, rate_hz):
+    period_ns = NANOS_PER_SEC // rate_hz
+    df = spark.range(bag_length_secs * rate_hz).withColumn(
+        "Time_ns",
+        func.lit(BAG_START_NS)
+        + func.col("id") * period_ns
+        + (func.rand(seed=7) * (period_ns // 10)).cast("long"),
+    )
+
+    if topic == DETECTIONS_TOPIC:
+        bbox = func.struct(
+            func.when(func.rand(seed=1) < 0.4, "person").otherwise("car").alias("Class"),
+            (func.rand(seed=2) * 1280).alias("x"),
+            (300 + func.rand(seed=3) * 420).alias("y"),
+            (20 + func.rand(seed=4) * 150).alias("width"),
+            (20 + func.rand(seed=5) * 150).alias("height"),
+        )
+        df = df.withColumn(
+            "detections_bboxes_clean",
+            func.when(func.col("id") % 3 == 0, func.to_json(func.array(bbox, bbox))).otherwise(
+                func.to_json(func.array(bbox))
+            ),
+        )
+    elif topic == LANES_TOPIC:
+        payloads = lane_payloads()
+        variants = func.array(*[func.lit(p) for p in payloads])
+        df = df.withColumn(
+            "lanes_clean", func.element_at(variants, (func.col("id") % len(payloads) + 1).cast("int"))
+        )
+    else:
+        df = df.withColumn("value_a", func.rand(seed=11)).withColumn(
+            "value_b", func.rand(seed=12) * 100
+        )
+
+    return (
+        df.withColumn("Time", func.col("Time_ns") / NANOS_PER_SEC)
+        .withColumn("bag_file_prefix", func.lit("benchmark/"))
+        .withColumn("bag_file_bucket", func.lit("benchmark"))
+        .drop("id")
+    )
+
+
+def generate_batch(spark, root, num_bags, bag_length_secs, num_topics):
+    """
+    Write synthetic topics to root/bag_parquets/<topic>/bag_file=<bag>/ and return the matching batch metadata
+    """
+    topics = [DETECTIONS_TOPIC, LANES_TOPIC] + [
+        f"synthetic_topic_{i:02d}_signal" for i in range(max(num_topics - 2, 0))
+    ]
+    batch_metadata = []
+    for bag in range(num_bags):
+        bag_file = f"benchmark_bag_{bag:04d}"
+        files = []
+        for topic in topics:
+            rate_hz = 10 if topic in (DETECTIONS_TOPIC, LANES_TOPIC) else 50
+            path = f"file://{root}/bag_parquets/{topic}/bag_file={bag_file}"
+            topic_frame(spark, topic, bag_length_secs, rate_hz).coalesce(1).write.mode(
+                "overwrite"
+            ).parquet(path)
+            files.append(path)
+        batch_metadata.append({"Name": bag_file, "files": files, "topics": topics})
+    return batch_metadata
+
+
+def stages(spark, status=None):
+    sc = spark.sparkContext
+    url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages"
+    if status:
+        url = f"{url}?status={status}"
+    with urlopen(url) as response:
+        return json.load(response)
+
+
+def next_stage_id(spark):
+    return max([s["stageId"] for s in stages(spark)], default=-1) + 1
+
+
+def parse_ui_time(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%Z")
+
+
+def stage_metrics(spark, first_stage_id, timeout_secs=10):
+    """
+    Metrics of the completed stages with id >= first_stage_id, once the UI has caught up with them
+    """
+    deadline = time.time() + timeout_secs
+    while stages(spark, status="active") and time.time() < deadline:
+        time.sleep(0.2)
+
+    metrics = []
+    for s in sorted(stages(spark, status="complete"), key=lambda s: s["stageId"]):
+        if s["stageId"] < first_stage_id:
+            continue
+        duration = parse_ui_time(s["completionTime"]) - parse_ui_time(s["submissionTime"])
+        metrics.append(
+            {
+                "stage_id": s["stageId"],
+                "name": s["name"],
+                "num_tasks": s["numTasks"],
+                "duration_secs": duration.total_seconds(),
+                "executor_run_secs": s["executorRunTime"] / 1000,
+                "input_bytes": s["inputBytes"],
+                "shuffle_read_bytes": s["shuffleReadBytes"],
+                "shuffle_write_bytes": s["shuffleWriteBytes"],
+                "memory_bytes_spilled": s["memoryBytesSpilled"],
+                "disk_bytes_spilled": s["diskBytesSpilled"],
+            }
+        )
+    return metrics
+
+
+def timed_run(spark, job_name, config, fn):
+    first_stage_id = next_stage_id(spark)
+    start = time.time()
+    fn()
+    wall_secs = time.time() - start
+    stage_list = stage_metrics(spark, first_stage_id)
+    result = dict(
+        config,
+        job=job_name,
+        wall_secs=wall_secs,
+        num_stages=len(stage_list),
+        shuffle_read_bytes=sum(s["shuffle_read_bytes"] for s in stage_list),
+        shuffle_write_bytes=sum(s["shuffle_write_bytes"] for s in stage_list),
+        spilled_bytes=sum(
+            s["memory_bytes_spilled"] + s["disk_bytes_spilled"] for s in stage_list
+        ),
+        stages=stage_list,
+    )
+    print(
+        f"{job_name:20s} bags={config['num_bags']:<4d} length={config['bag_length_secs']:<5d} "
+        f"topics={config['num_topics']:<3d} wall={wall_secs:8.2f}s stages={len(stage_list):<3d} "
+        f"shuffle_write={result['shuffle_write_bytes']:>12d}B spilled={result['spilled_bytes']:>10d}B"
+    )
+    return result
+
+
+def run_config(spark, work_dir, config, prune_columns, fused=False):
+    root = os.path.join(work_dir, f"run_{config['num_bags']}_{config['bag_length_secs']}_{config['num_topics']}")
+    shutil.rmtree(root, ignore_errors=True)
+    batch_metadata = generate_batch(spark, root, **config)
+    synchronized_bucket = f"file://{root}/synchronized"
+    scenes_bucket = f"file://{root}/scenes"
+
+    results = [
+        timed_run(
+            spark,
+            "synchronize_topics",
+            config,
+            lambda: synchronize_topics.main(
+                None,
+                None,
+                synchronized_bucket,
+                spark,
+                all_columns=not prune_columns,
+                batch_metadata=batch_metadata,
+            ),
+        ),
+        timed_run(
+            spark,
+            "detect_scenes",
+            config,
+            lambda: detect_scenes.main(
+                None,
+                None,
+                synchronized_bucket,
+                scenes_bucket,
+                None,
+                spark,
+                batch_metadata=batch_metadata,
+            ),
+        ),
+    ]
+    if fused:
+        results.append(
+            timed_run(
+                spark,
+                "synchronize_and_detect",
+                config,
+                lambda: synchronize_and_detect.main(
+                    None,
+                    None,
+                    f"file://{root}/fused_synchronized",
+                    f"file://{root}/fused_scenes",
+                    None,
+                    spark,
+                    all_columns=not prune_columns,
+                    batch_metadata=batch_metadata,
+                ),
+            )
+        )
+    return results
+
+
+def main(arguments):
+    spark = (
+        SparkSession.builder.master(arguments.master)
+        .appName("scene-detection-benchmark")
+        .config("spark.sql.shuffle.partitions", arguments.shuffle_partitions)
+        .getOrCreate()
+    )
+    for module in os.listdir(SPARK_SCRIPTS_DIR):
+        if module.endswith(".py"):
+            spark.sparkContext.addPyFile(os.path.join(SPARK_SCRIPTS_DIR, module))
+
+    work_dir = os.path.abspath(
+        arguments.work_dir or tempfile.mkdtemp(prefix="scene-detection-benchmark-")
+    )
+    sweep = itertools.product(
+        int_list(arguments.num_bags),
+        int_list(arguments.bag_length_secs),
+        int_list(arguments.num_topics),
+    )
+
+    results = []
+    for num_bags, bag_length_secs, num_topics in sweep:
+        config = {
+            "num_bags": num_bags,
+            "bag_length_secs": bag_length_secs,
+            "num_topics": num_topics,
+        }
+        results.extend(
+            run_config(spark, work_dir, config, arguments.prune_columns, arguments.fused)
+        )
+
+    if arguments.output:
+        with open(arguments.output, "a") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+
+    spark.stop()
+    return results
+
+
+if __name__ == "__main__":
+    main(parse_arguments(sys.argv[1:]))
@@ -40,6 +40,7 @@ class Fargate(core.Stack):
         input_bucket_name: str,
         output_bucket_name: str,
         topics_to_extract: [str],
+        grid_interval_ns: int = None,
         **kwargs,
     ) -> None:
         """
@@ -273,6 +274,7 @@ class Fargate(core.Stack):
                 "s3_destination": dest_bucket.bucket_name,
                 "topics_to_extract": topics_to_extract,
                 "dynamo_table_name": dynamo_table.table_name,
+                "grid_interval_ns": str(grid_interval_ns or ""),
             },
             logging=logs,
         )
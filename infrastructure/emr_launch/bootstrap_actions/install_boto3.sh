@@ -1,2 +1,4 @@
 #!/bin/bash
-sudo python3 -m pip install boto3
\ No newline at end of file
+sudo python3 -m pip install boto3
+# Arrow batches for the mapInPandas detection functions
+sudo python3 -m pip install pandas==1.1.5 pyarrow==2.0.0
\ No newline at end of file
@@ -26,12 +26,17 @@ class StepFunctionStack(core.Stack):
         synchronized_bucket,
         scenes_bucket,
         glue_db_name,
+        fuse_spark_steps=False,
+        grid_mode=False,
         **kwargs,
     ):
         super().__init__(scope, id, **kwargs)
 
         launch_function = emr_launch_stack.launch_function
 
+        # Synchronize from the grid aligned files when the extraction task writes them
+        synchronize_args = ["--grid-mode"] if grid_mode else []
+
         # Create DynamoDB table for tracking
         dynamo_table = dynamo.Table(
             self,
@@ -108,6 +113,22 @@ class StepFunctionStack(core.Stack):
             sources=[s3d.Source.asset("spark_scripts/")],
         )
 
+        # Modules shared by the PySpark jobs, shipped with every spark-submit
+        py_files = ",".join(
+            os.path.join(f"s3://{artifact_bucket.bucket_name}", "steps", module)
+            for module in [
+                "common.py",
+                "scene_detectors.py",
+                "lane_geometry.py",
+                "spark_metrics.py",
+                "spark_utils.py",
+                "topic_changes.py",
+                "scene_segments.py",
+                "dynamo_writer.py",
+                "scene_index.py",
+            ]
+        )
+
         # Create a Chain to receive Failure messages
         fail = emr_chains.Fail(
             self,
@@ -139,79 +160,145 @@ class StepFunctionStack(core.Stack):
             fail_chain=fail,
         )
 
-        synchronize = emr_chains.AddStepWithArgumentOverrides(
-            self,
-            "PySparkSynchronizeTopics",
-            emr_step=emr_code.EMRStep(
-                name=f"Synchronize Topics - PySpark Job",
-                jar="command-runner.jar",
-                args=[
-                    "spark-submit",
-                    "--master",
-                    "yarn",
-                    "--deploy-mode",
-                    "cluster",
-                    "--executor-cores",
-                    "3",
-                    os.path.join(
-                        f"s3://{artifact_bucket.bucket_name}",
-                        "steps",
-                        "synchronize_topics.py",
-                    ),
-                    "--batch-id",
-                    "DynamoDB.BatchId",
-                    "--batch-metadata-table-name",
-                    dynamo_table.table_name,
-                    "--output-bucket",
-                    synchronized_bucket.bucket_name,
-                ],
-            ),
-            cluster_id=sfn.TaskInput.from_data_at(
-                "$.LaunchClusterResult.ClusterId"
-            ).value,
-            result_path="$.PySparkResult",
-            fail_chain=terminate_failed_cluster,
-        )
+        if fuse_spark_steps:
+            # One application synchronizing and detecting, the synchronized topics
+            # are handed to detection in memory and written to S3 as a side output
+            synchronize_and_detect = emr_chains.AddStepWithArgumentOverrides(
+                self,
+                "SynchronizeAndDetect",
+                emr_step=emr_code.EMRStep(
+                    name=f"Synchronize and Detect Scenes - PySpark Job",
+                    jar="command-runner.jar",
+                    args=[
+                        "spark-submit",
+                        "--master",
+                        "yarn",
+                        "--deploy-mode",
+                        "cluster",
+                        "--executor-cores",
+                        "3",
+                        "--py-files",
+                        ",".join(
+                            [
+                                py_files,
+                                os.path.join(
+                                    f"s3://{artifact_bucket.bucket_name}",
+                                    "steps",
+                                    "synchronize_topics.py",
+                                ),
+                                os.path.join(
+                                    f"s3://{artifact_bucket.bucket_name}",
+                                    "steps",
+                                    "detect_scenes.py",
+                                ),
+                            ]
+                        ),
+                        os.path.join(
+                            f"s3://{artifact_bucket.bucket_name}",
+                            "steps",
+                            "synchronize_and_detect.py",
+                        ),
+                        "--batch-id",
+                        "DynamoDB.BatchId",
+                        "--batch-metadata-table-name",
+                        dynamo_table.table_name,
+                        "--synchronized-bucket",
+                        synchronized_bucket.bucket_name,
+                        "--scenes-bucket",
+                        scenes_bucket.bucket_name,
+                        "--output-dynamo-table",
+                        dynamo_table_scenes.table_name,
+                        *synchronize_args,
+                    ],
+                ),
+                cluster_id=sfn.TaskInput.from_data_at(
+                    "$.LaunchClusterResult.ClusterId"
+                ).value,
+                result_path="$.SceneResult",
+                fail_chain=terminate_failed_cluster,
+            )
+            spark_steps = sfn.Chain.start(synchronize_and_detect)
+        else:
+            synchronize = emr_chains.AddStepWithArgumentOverrides(
+                self,
+                "PySparkSynchronizeTopics",
+                emr_step=emr_code.EMRStep(
+                    name=f"Synchronize Topics - PySpark Job",
+                    jar="command-runner.jar",
+                    args=[
+                        "spark-submit",
+                        "--master",
+                        "yarn",
+                        "--deploy-mode",
+                        "cluster",
+                        "--executor-cores",
+                        "3",
+                        "--py-files",
+                        py_files,
+                        os.path.join(
+                            f"s3://{artifact_bucket.bucket_name}",
+                            "steps",
+                            "synchronize_topics.py",
+                        ),
+                        "--batch-id",
+                        "DynamoDB.BatchId",
+                        "--batch-metadata-table-name",
+                        dynamo_table.table_name,
+                        "--output-bucket",
+                        synchronized_bucket.bucket_name,
+                        "--metrics-bucket",
+                        scenes_bucket.bucket_name,
+                        *synchronize_args,
+                    ],
+                ),
+                cluster_id=sfn.TaskInput.from_data_at(
+                    "$.LaunchClusterResult.ClusterId"
+                ).value,
+                result_path="$.PySparkResult",
+                fail_chain=terminate_failed_cluster,
+            )
 
-        scene_detection = emr_chains.AddStepWithArgumentOverrides(
-            self,
-            "SceneDetection",
-            emr_step=emr_code.EMRStep(
-                name=f"Scene Detection - PySpark Job",
-                jar="command-runner.jar",
-                args=[
-                    "spark-submit",
-                    "--master",
-                    "yarn",
-                    "--deploy-mode",
-                    "cluster",
-                    "--executor-cores",
-                    "3",
-                    "--packages",
-                    "com.audienceproject:spark-dynamodb_2.12:1.1.1",
-                    os.path.join(
-                        f"s3://{artifact_bucket.bucket_name}",
-                        "steps",
-                        "detect_scenes.py",
-                    ),
-                    "--batch-id",
-                    "DynamoDB.BatchId",
-                    "--batch-metadata-table-name",
-                    dynamo_table.table_name,
-                    "--input-bucket",
-                    synchronized_bucket.bucket_name,
-                    "--output-bucket",
-                    scenes_bucket.bucket_name,
-                    "--output-dynamo-table",
-                    dynamo_table_scenes.table_name,
-                ],
-            ),
-            cluster_id=sfn.TaskInput.from_data_at(
-                "$.LaunchClusterResult.ClusterId"
-            ).value,
-            result_path="$.SceneResult",
-            fail_chain=terminate_failed_cluster,
-        )
+            scene_detection = emr_chains.AddStepWithArgumentOverrides(
+                self,
+                "SceneDetection",
+                emr_step=emr_code.EMRStep(
+                    name=f"Scene Detection - PySpark Job",
+                    jar="command-runner.jar",
+                    args=[
+                        "spark-submit",
+                        "--master",
+                        "yarn",
+                        "--deploy-mode",
+                        "cluster",
+                        "--executor-cores",
+                        "3",
+                        "--py-files",
+                        py_files,
+                        os.path.join(
+                            f"s3://{artifact_bucket.bucket_name}",
+                            "steps",
+                            "detect_scenes.py",
+                        ),
+                        "--batch-id",
+                        "DynamoDB.BatchId",
+                        "--batch-metadata-table-name",
+                        dynamo_table.table_name,
+                        "--input-bucket",
+                        synchronized_bucket.bucket_name,
+                        "--output-bucket",
+                        scenes_bucket.bucket_name,
+                        "--output-dynamo-table",
+                        dynamo_table_scenes.table_name,
+                    ],
+                ),
+                cluster_id=sfn.TaskInput.from_data_at(
+                    "$.LaunchClusterResult.ClusterId"
+                ).value,
+                result_path="$.SceneResult",
+                fail_chain=terminate_failed_cluster,
+            )
+
+            spark_steps = sfn.Chain.start(synchronize).next(scene_detection)
 
         # Define a Task to Terminate the Cluster
         terminate_cluster = emr_tasks.TerminateClusterBuilder.build(
@@ -236,8 +323,7 @@ class StepFunctionStack(core.Stack):
         # Assemble the Pipeline
         definition = (
             sfn.Chain.start(launch_cluster)
-            .next(synchronize)
-            .next(scene_detection)
+            .next(spark_steps)
             .next(terminate_cluster)
             .next(success)
         )
@@ -117,6 +117,38 @@ def process_sns_message(record, table, current_batch_id):
     """
     message = parse_s3_event(record)
 
+    if message["topic"].endswith("_grid"):
+        # Grid aligned copies of a topic are listed with the bag, they do not count towards the batch
+        key = {
+            "BatchId": current_batch_id,
+            "Name": message["bag_file"],
+        }
+        grid_file = f"s3://{message['bucket']}/{message['key']}"
+        try:
+            updated_item = table.update_item(
+                Key=key,
+                UpdateExpression="SET bag_file=:bf, grid_files = list_append(if_not_exists(grid_files, :empty_list), :new_object)",
+                # Retried events must not list the same file twice
+                ConditionExpression="attribute_not_exists(grid_files) OR NOT contains(grid_files, :grid_file)",
+                ExpressionAttributeValues={
+                    ":empty_list": [],
+                    ":new_object": [grid_file],
+                    ":grid_file": grid_file,
+                    ":bf": message["bag_file"],
+                },
+                ReturnValues="ALL_NEW",
+            )["Attributes"]
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.info(f"{grid_file} is already listed for {message['bag_file']}")
+            updated_item = table.get_item(Key=key)["Item"]
+        latest = table.get_item(
+            Key={
+                "BatchId": "LATEST",
+                "Name": "LATEST",
+            }
+        )["Item"]
+        return latest, updated_item
+
     # Add new file to latest batch
     updated_item = table.update_item(
         Key={
@@ -158,7 +190,8 @@ def should_lambda_trigger_pipeline(latest_batch, latest_bag_file):
     num_topics = int(os.environ["NUM_TOPICS"])
     min_num_bags_to_process = 2
 
-    all_topics_in_dynamo = len(list(set(latest_bag_file["topics"]))) == num_topics
+    # Bags only holding grid files so far have no topics yet
+    all_topics_in_dynamo = len(list(set(latest_bag_file.get("topics", [])))) == num_topics
     number_of_bag_files_in_batch = latest_batch["NumFiles"] / num_topics
     return (
         all_topics_in_dynamo and number_of_bag_files_in_batch >= min_num_bags_to_process
@@ -182,6 +215,9 @@ def trigger_pipeline(current_batch_id, pipeline_arn, cluster_name):
                     "DynamoDB.BatchId": current_batch_id
                 },
                 "Scene Detection - PySpark Job": {"DynamoDB.BatchId": current_batch_id},
+                "Synchronize and Detect Scenes - PySpark Job": {
+                    "DynamoDB.BatchId": current_batch_id
+                },
             },
             "BatchId": current_batch_id,
         }
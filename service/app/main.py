@@ -5,6 +5,7 @@ import shutil
 import time
 from botocore.exceptions import ClientError
 from bagpy import bagreader
+import numpy
 import pandas as pd
 import fastparquet
 import yaml
@@ -12,12 +13,17 @@ import yaml
 
 logging.getLogger().setLevel(logging.INFO)
 
+# Time span of a parquet row group, so readers of a time range can skip the row groups outside it
+# by their Time_ns statistics
+ROW_GROUP_NS = 5_000_000_000
+
 
 def parse_file(
     s3_src_bucket: str,
     s3_src_prefix: str,
     s3_dest_bucket: str,
     topics_to_extract: [str],
+    grid_interval_ns: int = None,
 ):
 
     now = str(int(time.time()))
@@ -35,7 +41,12 @@ def parse_file(
 
     # Process File locally
     process_file(
-        local_file, s3_src_prefix, s3_src_bucket, output_dir, topics_to_extract
+        local_file,
+        s3_src_prefix,
+        s3_src_bucket,
+        output_dir,
+        topics_to_extract,
+        grid_interval_ns=grid_interval_ns,
     )
 
     s3_dest_prefix = "bag_parquets"
@@ -58,6 +69,85 @@ def parse_yaml_val(str_val, obj_start):
     return objects
 
 
+def time_to_ns(time_str):
+    """
+    Convert a decimal seconds timestamp string to integer nanoseconds without float rounding
+    :param time_str: e.g. "1608047300.123456789"
+    :return:
+    """
+    secs, _, frac = str(time_str).strip().partition(".")
+    return int(secs) * 1_000_000_000 + int(frac[:9].ljust(9, "0"))
+
+
+def nullable_dtype(dtype):
+    """
+    pandas nullable extension type of a numpy integer or boolean dtype, None for other dtypes
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+        return dtype.name.replace("uint", "UInt").replace("int", "Int")
+    return None
+
+
+def grid_aligned(df_out, first_tick, last_tick, grid_interval_ns):
+    """
+    Last message at or before every grid tick of the bag, one row per tick
+
+    Time and Time_ns are the tick, message_Time_ns the timestamp of the message carried onto it,
+    null on ticks before the topic's first message
+    :param df_out: extracted topic messages
+    :param first_tick: first tick of the bag, in units of grid_interval_ns
+    :param last_tick: tick after the last one of the bag
+    :param grid_interval_ns:
+    :return:
+    """
+    ticks_ns = numpy.arange(first_tick, last_tick, dtype="int64") * grid_interval_ns
+    messages = (
+        df_out.drop(columns=["Time", "bag_file_prefix", "bag_file_bucket"])
+        .rename(columns={"Time_ns": "message_Time_ns"})
+        .sort_values("message_Time_ns", kind="stable")
+        .reset_index(drop=True)
+    )
+    # Rows are taken by position rather than joined, so integer and boolean fields keep their type,
+    # as nullable types for the ticks before the topic's first message
+    idx = numpy.searchsorted(messages["message_Time_ns"].values, ticks_ns, side="right") - 1
+    grid_df = messages.take(idx.clip(0)).reset_index(drop=True)
+    grid_df = grid_df.astype(
+        {c: nullable_dtype(dtype) for c, dtype in grid_df.dtypes.items() if nullable_dtype(dtype)}
+    )
+    grid_df.loc[idx < 0, :] = None
+    grid_df.insert(0, "Time_ns", ticks_ns)
+    grid_df["Time"] = grid_df["Time_ns"] / 1_000_000_000
+    grid_df["bag_file_prefix"] = df_out["bag_file_prefix"].iloc[0]
+    grid_df["bag_file_bucket"] = df_out["bag_file_bucket"].iloc[0]
+    return grid_df
+
+
+def time_row_group_offsets(time_ns, row_group_ns=ROW_GROUP_NS):
+    """
+    First row of every row_group_ns window of the sorted message times
+    """
+    if len(time_ns) == 0:
+        return [0]
+    window_starts = numpy.arange(time_ns[0], time_ns[-1] + 1, row_group_ns)
+    return sorted(set(numpy.searchsorted(time_ns, window_starts).tolist()))
+
+
+def write_topic_parquet(df, output_dir, clean_topic, local_file_name):
+    topic_output_dir = os.path.join(output_dir, clean_topic)
+    clean_directory(topic_output_dir)
+    topic_output_dir = os.path.join(topic_output_dir, "bag_file=" + local_file_name)
+    clean_directory(topic_output_dir)
+    output_path = os.path.join(topic_output_dir, "data.parq")
+    df = df.sort_values("Time_ns", kind="stable").reset_index(drop=True)
+    fastparquet.write(
+        output_path,
+        df,
+        row_group_offsets=time_row_group_offsets(df["Time_ns"].values),
+    )
+
+
 def save_metadata_to_dynamo(bag, s3_prefix, local_file_name, s3_bucket):
     dynamodb = boto3.resource("dynamodb")
     table = dynamodb.Table(os.environ["dynamo_table_name"])
@@ -74,13 +164,23 @@ def save_metadata_to_dynamo(bag, s3_prefix, local_file_name, s3_bucket):
     table.put_item(Item=item)
 
 
-def process_file(local_file, s3_prefix, s3_bucket, output_dir, topics_to_extract):
+def process_file(
+    local_file,
+    s3_prefix,
+    s3_bucket,
+    output_dir,
+    topics_to_extract,
+    grid_interval_ns=None,
+):
     """
     Extract Rosbag Topics from input file to output_dir
 
+    With grid_interval_ns, every topic is also written aligned to the bag's time grid under
+    <topic>_grid/, so synchronization can join topics on the tick instead of forward filling
     :param local_file:
     :param output_dir:
     :param topics_to_extract:
+    :param grid_interval_ns: grid tick length, e.g. 100000000 for the 0.1 s grid of synchronize_topics
     :return:
     """
 
@@ -89,14 +189,16 @@ def process_file(local_file, s3_prefix, s3_bucket, output_dir, topics_to_extract
     local_file_name = local_file.split("/")[-1].replace(".bag", "")
     save_metadata_to_dynamo(bag, s3_prefix, local_file_name, s3_bucket)
 
-
+    topic_dfs = {}
     for topic in topics_to_extract:
         data = bag.message_by_topic(topic)
         if data is None:
             logging.info("No data found for {topic}".format(topic=topic))
         else:
             logging.info("Reading data found for {topic}".format(topic=topic))
-            df_out = pd.read_csv(data)
+            df_out = pd.read_csv(data, dtype={"Time": str})
+            df_out["Time_ns"] = df_out["Time"].apply(time_to_ns).astype("int64")
+            df_out["Time"] = df_out["Time"].astype(float)
             df_out.columns = [x.replace(".", "_") for x in df_out.columns]
             for col in df_out.columns:
                 # parse complex objects:
@@ -115,14 +217,19 @@ def process_file(local_file, s3_prefix, s3_bucket, output_dir, topics_to_extract
             df_out["bag_file_prefix"] = s3_prefix
             df_out["bag_file_bucket"] = s3_bucket
             clean_topic = topic.replace("/", "_")[1:]
-            topic_output_dir = os.path.join(output_dir, clean_topic)
-            clean_directory(topic_output_dir)
-            topic_output_dir = os.path.join(
-                topic_output_dir, "bag_file=" + local_file_name
-            )
-            clean_directory(topic_output_dir)
-            output_path = os.path.join(topic_output_dir, "data.parq")
-            fastparquet.write(output_path, df_out)
+            write_topic_parquet(df_out, output_dir, clean_topic, local_file_name)
+            if grid_interval_ns:
+                topic_dfs[clean_topic] = df_out
+
+    if topic_dfs:
+        # Same grid as synchronize_topics: ticks from the bag's first to its last message
+        first_tick = min(df["Time_ns"].min() for df in topic_dfs.values()) // grid_interval_ns
+        last_tick = max(df["Time_ns"].max() for df in topic_dfs.values()) // grid_interval_ns
+        for clean_topic, df_out in topic_dfs.items():
+            if last_tick <= first_tick:
+                break
+            grid_df = grid_aligned(df_out, first_tick, last_tick, grid_interval_ns)
+            write_topic_parquet(grid_df, output_dir, f"{clean_topic}_grid", local_file_name)
     print_files_in_path(output_dir)
 
 
@@ -184,7 +291,8 @@ def s3_sync_results(bucket, prefix, local_dir):
     :param local_dir:
     :return:
     """
-    files = absolute_file_paths(local_dir)
+    # Grid aligned files first, so they are recorded before the raw topic files complete a bag
+    files = sorted(absolute_file_paths(local_dir), key=lambda f: "_grid/" not in f)
     for local_path in files:
         f = local_path.split(local_dir)[-1]
         s3_path = os.path.join(prefix, f)
@@ -208,4 +316,5 @@ if __name__ == "__main__":
         s3_src_prefix=os.environ["s3_source_prefix"],
         s3_dest_bucket=os.environ["s3_destination"],
         topics_to_extract=os.environ["topics_to_extract"].split(","),
+        grid_interval_ns=int(os.environ.get("grid_interval_ns") or 0) or None,
     )
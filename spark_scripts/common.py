@@ -0,0 +1,44 @@
+"""
+Constants and table locations shared by the Spark jobs, the local engine and the query helpers.
+"""
+import boto3
+
+NANOS_PER_SEC = 1_000_000_000
+# Spacing of the synchronized time grid
+TIME_INTERVAL_NS = 100_000_000
+# Columns identifying a bag, carried by every table
+BAG_COLS = ["bag_file", "bag_file_prefix", "bag_file_bucket"]
+# Columns every extracted topic file carries besides its topic fields
+KEY_COLS = ["Time", "Time_ns", "bag_file_prefix", "bag_file_bucket"]
+# Per tick detections. Versioned since detections became an array of structs, the partitions of
+# scene_detections hold the earlier array of maps and are left as they are.
+DETECTIONS_TABLE = "scene_detections_v2"
+
+
+def table_path(bucket, table_name):
+    """
+    s3 location of a table, or a local one when bucket is already a URI such as file:///tmp/out
+    """
+    if "://" in bucket:
+        return f"{bucket}/{table_name}"
+    return f"s3://{bucket}/{table_name}"
+
+
+def get_batch_file_metadata(table_name, batch_id):
+    """
+    All bag items of a batch in the batch metadata table, following the query pagination
+    """
+    dynamodb = boto3.resource("dynamodb", region_name="eu-west-1")
+    table = dynamodb.Table(table_name)
+    key_conditions = {
+        "BatchId": {"AttributeValueList": [batch_id], "ComparisonOperator": "EQ"}
+    }
+    response = table.query(KeyConditions=key_conditions)
+    data = response["Items"]
+    while "LastEvaluatedKey" in response:
+        response = table.query(
+            KeyConditions=key_conditions,
+            ExclusiveStartKey=response["LastEvaluatedKey"],
+        )
+        data.extend(response["Items"])
+    return data
@@ -1,256 +1,357 @@
-from pyspark.sql import SparkSession, Row, Window, types
-from pyspark.sql.types import StringType
+from pyspark.sql import SparkSession, Row, types
 
-import boto3
 import argparse
+import json
 import sys
 import functools
+import hashlib
 import pyspark.sql.functions as func
-import numpy
-import json
-
-
-def distance(p1, p2):
-    a = numpy.array((p1['x'], p1['y'], 0))
-    b = numpy.array((p2['x'], p2['y'], 0))
-    return numpy.linalg.norm(a - b)
-
-
-def get_nearest_image_point(x, y, img_pts):
-    min_pt = None
-    min_dist = 1000
-    for i, pt in enumerate(img_pts):
-        d = distance({'x': x, 'y': y}, pt)
-        if d < min_dist:
-            min_dist = d
-            min_pt = pt
-            min_pt['dist'] = d
-    return min_pt
-
-
-def identify_nearest_lane_point(x, y, lane_points):
+from pyspark.sql.utils import AnalysisException
+from common import BAG_COLS, DETECTIONS_TABLE, NANOS_PER_SEC, get_batch_file_metadata, table_path
+from scene_detectors import (
+    SCENE_DETECTORS,
+    input_columns,
+    required_topic_columns,
+    run_detectors,
+    topics_analyzed,
+)
+from dynamo_writer import write_dynamo
+from scene_index import update_index
+from scene_segments import segment_scenes
+from spark_metrics import register_metrics_listener, write_metrics
+from spark_utils import persisted
+from topic_changes import expand_to_grid
+
+
+# Detections already written, one row per bag, detector version and input fingerprint
+CACHE_TABLE = "scene_detection_cache"
+CACHE_SCHEMA = types.StructType(
+    [
+        types.StructField("bag_file", types.StringType()),
+        types.StructField("detector_id", types.StringType()),
+        types.StructField("version", types.IntegerType()),
+        types.StructField("fingerprint", types.StringType()),
+    ]
+)
+
+DETECTED_OBJECT_TYPE = types.StructType(
+    [
+        types.StructField("Class", types.StringType()),
+        types.StructField("x", types.DoubleType()),
+        types.StructField("y", types.DoubleType()),
+        types.StructField("width", types.DoubleType()),
+        types.StructField("height", types.DoubleType()),
+        types.StructField("corners_in_lane", types.IntegerType()),
+        types.StructField("lanes", types.ArrayType(types.StructType(
+            [
+                types.StructField("left_lane", types.IntegerType()),
+                types.StructField("right_lane", types.IntegerType()),
+            ]
+        ))),
+    ]
+)
+DETECTIONS_TYPE = types.ArrayType(DETECTED_OBJECT_TYPE)
+
+# Spark 3.0 cannot pass arrays of structs through Arrow, the detections leave the Python
+# workers as JSON and are parsed to DETECTIONS_TYPE by Spark
+DETECTION_SCHEMA = types.StructType(
+    [
+        types.StructField("Time", types.DoubleType()),
+        types.StructField("Time_ns", types.LongType()),
+        types.StructField("detector_id", types.StringType()),
+        types.StructField("detections", types.StringType()),
+        types.StructField("scene_signal", types.LongType()),
+        types.StructField("bag_file", types.StringType()),
+        types.StructField("bag_file_prefix", types.StringType()),
+        types.StructField("bag_file_bucket", types.StringType()),
+    ]
+)
+
+
+def run_detectors_on_batches(batches, detectors=SCENE_DETECTORS):
     """
-    Given an x,y coordinate in the image, identify closest lane point per lane
+    mapInPandas function running the detectors over each Arrow batch of synchronized rows
     """
-    v = json.loads(lane_points)['lanes_clean']
-    lanes = json.loads(v)
-
-    nearest_pts = {}
-    for idx, lane in enumerate(lanes):
-        if lane:
-            img_pts = lane['image_points']
-            nearest_pts[idx] = get_nearest_image_point(x, y, img_pts)
-
-    return nearest_pts
-
+    for pdf in batches:
+        keys = pdf[["Time", "Time_ns", *BAG_COLS]]
+        for detections in run_detectors(pdf, detectors):
+            detections["detections"] = [
+                None if objects is None else json.dumps(objects) for objects in detections["detections"]
+            ]
+            yield keys.join(detections)[DETECTION_SCHEMA.fieldNames()]
 
-def between_nums(x, i1, i2):
-    return (i1 >= x >= i2) or (i1 <= x <= i2)
 
-
-def point_in_lane(x, y, closest_points):
-    is_in_lane = False
-    lane = None
-    for lane_idx, closest_point in closest_points.items():
-        # if last_lane, then end
-        if lane_idx == len(closest_points) - 1:
-            continue
-        next_lane_closest_point = closest_points[lane_idx + 1]
-        # TODO consider y coordinates as well
-        if between_nums(x, next_lane_closest_point['x'], closest_point['x']):
-            is_in_lane = True
-            lane = f"between_{lane_idx}_and_{lane_idx + 1}"
-            break
-    return is_in_lane, lane
-
-
-def is_object_in_lane(obj, lane_points):
-    obj_corner_x_min = obj['x'] - obj['width'] / 2
-    obj_corner_x_max = obj['x'] + obj['width'] / 2
-    obj_corner_y_min = obj['y'] - obj['height'] / 2
-    obj_corner_y_max = obj['y'] + obj['height'] / 2
-
-    corners_in_lane = 0
-    lanes = []
-    for obj_corner in [
-        (obj_corner_x_min, obj_corner_y_min),
-        (obj_corner_x_max, obj_corner_y_min),
-        (obj_corner_x_min, obj_corner_y_max),
-        (obj_corner_x_max, obj_corner_y_max),
-    ]:
-        x = obj_corner[0]
-        y = obj_corner[1]
-        closest_points = identify_nearest_lane_point(x, y, lane_points=lane_points)
-        in_lane = point_in_lane(x, y, closest_points)
-        if in_lane[0]:
-            corners_in_lane += 1
-            lane = in_lane[1]
-            if lane not in lanes:
-                lanes.append(lane)
-    return corners_in_lane, lanes
-
-
-def obj_in_lane_detection(row):
-    if row.get('rgb_right_detections_only_clean') and row.get('post_process_lane_points_rgb_front_right_clean'):
-        objects_in_lane = []
-        objects = json.loads(json.loads(row['rgb_right_detections_only_clean']).get('detections_bboxes_clean', []))
-        lane_points = row['post_process_lane_points_rgb_front_right_clean']
-        for o in objects:
-            corners_in_lane, lanes = is_object_in_lane(obj=o, lane_points=lane_points)
-            o.update(
-                {
-                    'corners_in_lane': corners_in_lane,
-                    'lanes': lanes,
-                }
-            )
-            if corners_in_lane:
-                objects_in_lane.append(o)
-
-        row['objects_in_lane'] = objects_in_lane
-    else:
-        row['objects_in_lane'] = None
-    return row
+def detect_scenes(synchronized_data, detectors=SCENE_DETECTORS):
+    """
+    Detections of the detectors, all registered ones by default, one row per synchronized row and
+    detector, from a single pass over synchronized_data
+    """
+    return synchronized_data.select(
+        'Time', 'Time_ns', "bag_file", "bag_file_prefix", "bag_file_bucket",
+        *[c for c in input_columns(detectors) if c in synchronized_data.columns]
+    ).mapInPandas(
+        functools.partial(run_detectors_on_batches, detectors=detectors), schema=DETECTION_SCHEMA
+    ).withColumn(
+        "detections", func.from_json("detections", DETECTIONS_TYPE)
+    ).select('Time', 'Time_ns', 'detector_id', 'detections', 'scene_signal', "bag_file", "bag_file_prefix", "bag_file_bucket")
 
 
-def detect_scenes(synchronized_data):
-    synced_rdd = synchronized_data.rdd.map(lambda row: row.asDict())
-    return synced_rdd.map(obj_in_lane_detection).toDF().select('Time', 'objects_in_lane', "bag_file", "bag_file_prefix","bag_file_bucket")
+def union_all(dfs):
+    column_superset = set()
+    for df in dfs:
+        for col in df.columns:
+            column_superset.add(col)
+    padded_dfs = []
+    for df in dfs:
+        for col in sorted(column_superset):
+            if col not in df.columns:
+                df = df.withColumn(col, func.lit(None).cast(types.LongType()))
+        padded_dfs.append(df)
+    return functools.reduce(lambda df1, df2: df1.union(df2.select(df1.columns)), padded_dfs)
+
+
+def detection_arguments():
+    """
+    Scene detection options shared by detect_scenes.py and synchronize_and_detect.py
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--min-scene-secs", type=float, default=0, help="Drop scenes shorter than this")
+    parser.add_argument("--merge-gap-secs", type=float, default=0, help="Merge scenes separated by at most this")
+    parser.add_argument("--dynamo-endpoint-url", help="DynamoDB endpoint, e.g. a local DynamoDB for testing")
+    return parser
 
 
-def union_all(dfs):
-    return functools.reduce(lambda df1, df2: df1.union(df2.select(df1.columns)), dfs)
+def detection_options(arguments):
+    """
+    Keyword arguments of process_synchronized_data() from options parsed with detection_arguments()
+    """
+    return dict(
+        min_duration_ns=int(arguments.min_scene_secs * NANOS_PER_SEC),
+        merge_gap_ns=int(arguments.merge_gap_secs * NANOS_PER_SEC),
+        dynamo_endpoint_url=arguments.dynamo_endpoint_url,
+    )
 
 
 def parse_arguments(args):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(parents=[detection_arguments()])
     parser.add_argument("--batch-metadata-table-name", required=True)
     parser.add_argument("--batch-id", required=True)
     parser.add_argument("--input-bucket", required=True)
     parser.add_argument("--output-bucket", required=True)
     parser.add_argument("--output-dynamo-table", required=True)
-    return parser.parse_args(args=args)
-
-
-def get_batch_file_metadata(table_name, batch_id):
-    dynamodb = boto3.resource('dynamodb', region_name='eu-west-1')
-    table = dynamodb.Table(table_name)
-    response = table.query(
-        KeyConditions={
-            'BatchId': {
-                'AttributeValueList': [batch_id],
-                'ComparisonOperator': 'EQ'
-            }
-        }
+    parser.add_argument("--metrics-bucket", help="Bucket for the spark_job_metrics table, defaults to the output bucket")
+    parser.add_argument(
+        "--input-format",
+        choices=["dense", "changes"],
+        default="dense",
+        help="Read synchronized_topics, or expand synchronized_topic_changes onto the time grid"
     )
-    data = response['Items']
-    while 'LastEvaluatedKey' in response:
-        response = table.query(ExclusiveStartKey=response['LastEvaluatedKey'])
-        data.update(response['Items'])
-    return data
+    parser.add_argument("--recompute", action="store_true", help="Ignore the detection cache and run every detector on every bag")
+    return parser.parse_args(args=args)
 
 
 def load_data(spark, input_bucket, table_name, batch_metadata):
     dfs = []
     for item in batch_metadata:
-        s3_path = f"s3://{input_bucket}/{table_name}/bag_file={item['Name']}/"
-        df = spark.read.option('basePath', f"s3://{input_bucket}/{table_name}/").load(s3_path)
+        base_path = table_path(input_bucket, table_name)
+        s3_path = f"{base_path}/bag_file={item['Name']}/"
+        df = spark.read.option('basePath', f"{base_path}/").load(s3_path)
         dfs.append(df)
 
     return union_all(dfs)
 
 
-def write_results_s3(df, table_name, output_bucket, partition_cols=[]):
-    s3_path = f"s3://{output_bucket}/{table_name}"
-    df.write.mode("append").partitionBy(*partition_cols).parquet(s3_path)
-
-
-def write_results_dynamo(df, output_dynamo_table):
-    df.write.mode("append").option("tableName", output_dynamo_table) \
-        .option("region", "eu-west-1") \
-        .format("dynamodb") \
-        .save()
-
-
-def people_in_scenes(row):
-    num_people_in_scene = 0
-    objects = row["objects_in_lane"]
-    if objects is not None:
-        for obj in objects:
-            if obj['Class'] == 'person':
-                num_people_in_scene += 1
-        row['num_people_in_scene'] = num_people_in_scene
-    return row
-
-
-def summarize_person_scenes(df):
-    people_in_lane = df.rdd.map(
-        lambda row: row.asDict()
-    ).map(
-        people_in_scenes
-    ).toDF()
-
-    scene_state_udf = func.udf(
-        lambda num, lag: "start" if num > 0 and lag == 0 else ("end" if num == 0 and lag > 0 else None), StringType())
-
-    win = Window.orderBy("Time").partitionBy("bag_file", "bag_file_prefix","bag_file_bucket")
-
-    people_in_lane = people_in_lane.withColumn(
-        "num_people_in_scene_lag1",
-        func.lag(
-            func.col("num_people_in_scene"),
-            1
-        ).over(win)
-    ).filter("num_people_in_scene is not null and num_people_in_scene_lag1 is not null ")
-
-    summary = people_in_lane.withColumn(
-        "scene_state",
-        scene_state_udf(people_in_lane.num_people_in_scene, people_in_lane.num_people_in_scene_lag1)
-    ).filter("scene_state is not null").withColumn(
-        "end_time",
-        func.lead(
-            func.col("Time"),
-            1
-        ).over(win)
-    ).filter("scene_state = 'start'") \
-        .withColumnRenamed("Time", "start_time") \
-        .withColumnRenamed("num_people_in_scene", "num_people_in_scene_start") \
-        .select("bag_file", "bag_file_prefix","bag_file_bucket", "start_time", "end_time", "num_people_in_scene_start") \
-        .withColumn("scene_id", func.concat(func.col("bag_file"), func.lit("_PersonInLane_"), func.col("start_time"))) \
-        .withColumn("scene_length", func.col("end_time") - func.col("start_time")) \
-        .withColumn("topics_analyzed", func.lit(",".join(["rgb_right_detections_only_clean","post_process_lane_points_rgb_front_right_clean"])))
+def write_results_s3(df, table_name, output_bucket, partition_cols=[], overwrite_partitions=False):
+    s3_path = table_path(output_bucket, table_name)
+    if overwrite_partitions:
+        # Replace only the partitions df writes to, the other partitions of the table are kept
+        writer = df.write.mode("overwrite").option("partitionOverwriteMode", "dynamic")
+    else:
+        writer = df.write.mode("append")
+    writer.partitionBy(*partition_cols).parquet(s3_path)
+
+
+def write_results_dynamo(df, output_dynamo_table, endpoint_url=None):
+    write_dynamo(df, output_dynamo_table, region="eu-west-1", endpoint_url=endpoint_url)
+
+
+def write_scene_index(scene_metadata_df, detected_scenes, output_bucket):
+    """
+    Merge the scenes into the scene index tables, see scene_index.py
+    """
+    bag_end = detected_scenes.groupBy("bag_file").agg(func.max("Time_ns").alias("bag_end_ns"))
+    index = scene_metadata_df.join(bag_end, on="bag_file", how="left") \
+        .withColumn("interval_end_ns", func.coalesce("end_time_ns", "bag_end_ns")) \
+        .withColumn("interval_length_ns", func.col("interval_end_ns") - func.col("start_time_ns")) \
+        .select("bag_file", "detector_id", "scene_id", "start_time_ns", "end_time_ns", "interval_end_ns", "interval_length_ns", "scene_length")
+
+    # A few rows per scene, merged into the single file of each index table on the driver,
+    # replacing the scenes previously detected for the same bags and detectors
+    detected_pairs = [tuple(r) for r in detected_scenes.select("bag_file", "detector_id").distinct().collect()]
+    update_index(output_bucket, [r.asDict() for r in index.collect()], replaced_pairs=detected_pairs)
+
+
+def summarize_scenes(df, detector, min_duration_ns=0, merge_gap_ns=0):
+    signal_name = detector["signal_name"]
+    detections = df.filter(func.col("detector_id") == detector["detector_id"]) \
+        .withColumnRenamed("scene_signal", signal_name)
+
+    summary = segment_scenes(
+        detections,
+        signal_name,
+        min_duration_ns=min_duration_ns,
+        merge_gap_ns=merge_gap_ns
+    ).withColumn("detector_id", func.lit(detector["detector_id"])) \
+        .withColumn("scene_id", func.concat(func.col("bag_file"), func.lit(f"_{detector['detector_id']}_"), func.col("start_time"))) \
+        .withColumn("scene_length", (func.col("end_time_ns") - func.col("start_time_ns")) / NANOS_PER_SEC) \
+        .withColumn("topics_analyzed", func.lit(topics_analyzed(detector)))
 
     return summary
 
 
-def scene_metadata(df):
-    return summarize_person_scenes(df)
+def scene_metadata(df, min_duration_ns=0, merge_gap_ns=0, detectors=SCENE_DETECTORS):
+    return union_all([
+        summarize_scenes(df, detector, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns)
+        for detector in detectors
+    ])
 
 
-def main(batch_metadata_table_name, batch_id, input_bucket, output_bucket, output_dynamo_table, spark):
-    # Load files to process
-    batch_metadata = get_batch_file_metadata(
-        table_name=batch_metadata_table_name,
-        batch_id=batch_id
-    )
+def process_synchronized_data(synchronized_data, output_bucket, output_dynamo_table, min_duration_ns=0, merge_gap_ns=0, dynamo_endpoint_url=None, detectors=SCENE_DETECTORS):
+    """
+    Detect scenes in synchronized topics, whether read back from S3 or handed over in memory,
+    and write the detections and scene metadata
+    """
+    detected_scenes = detect_scenes(synchronized_data, detectors)
+
+    # Detections are written to S3 and summarized for DynamoDB, persist them so detection runs once
+    with persisted(detected_scenes):
+        # Save the detections to S3, replacing those of earlier runs for the same bags and detectors
+        write_results_s3(
+            detected_scenes,
+            table_name=DETECTIONS_TABLE,
+            output_bucket=output_bucket,
+            partition_cols=['bag_file', 'detector_id'],
+            overwrite_partitions=True
+        )
+
+        scene_metadata_df = scene_metadata(detected_scenes, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns, detectors=detectors)
+
+        # Scene metadata feeds both index tables and DynamoDB
+        with persisted(scene_metadata_df):
+            write_scene_index(scene_metadata_df, detected_scenes, output_bucket)
+
+            if output_dynamo_table:
+                write_results_dynamo(
+                    scene_metadata_df,
+                    output_dynamo_table,
+                    endpoint_url=dynamo_endpoint_url
+                )
+
+
+def input_fingerprints(spark, input_bucket, table_name, bag_files):
+    """
+    sha256 of the name, size and modification time of every file in each bag's partition of the
+    input table, from the Hadoop FileSystem listing, None for bags without a partition
+    """
+    jvm = spark.sparkContext._jvm
+    hadoop_conf = spark.sparkContext._jsc.hadoopConfiguration()
+    base_path = table_path(input_bucket, table_name)
+    fingerprints = {}
+    for bag_file in bag_files:
+        path = jvm.org.apache.hadoop.fs.Path(f"{base_path}/bag_file={bag_file}/")
+        fs = path.getFileSystem(hadoop_conf)
+        if not fs.exists(path):
+            fingerprints[bag_file] = None
+            continue
+        files = fs.listFiles(path, True)
+        entries = []
+        while files.hasNext():
+            status = files.next()
+            entries.append(f"{status.getPath().getName()}:{status.getLen()}:{status.getModificationTime()}")
+        fingerprints[bag_file] = hashlib.sha256("\n".join(sorted(entries)).encode()).hexdigest()
+    return fingerprints
 
-    # Load topic data from s3 and union
-    synchronized_data = load_data(spark, input_bucket, batch_metadata=batch_metadata, table_name="synchronized_topics")
-    detected_scenes = detect_scenes(synchronized_data)
 
-    # Save Synchronized Signals to S3
-    write_results_s3(
-        detected_scenes,
-        table_name="scene_detections",
-        output_bucket=output_bucket,
-        partition_cols=['bag_file']
-    )
+def cached_detections(spark, output_bucket, bag_files):
+    """
+    (bag_file, detector_id, version, fingerprint) of the detections already written for the bags
+    """
+    try:
+        cache = spark.read.parquet(table_path(output_bucket, CACHE_TABLE))
+    except AnalysisException:
+        # No detection run has written the cache yet
+        return set()
+    return {
+        (r.bag_file, r.detector_id, r.version, r.fingerprint)
+        for r in cache.filter(func.col("bag_file").isin(bag_files)).collect()
+    }
+
+
+def cache_entries(items, fingerprints, detectors=SCENE_DETECTORS):
+    """
+    Cache rows recording the detectors' results for the bags, skipping bags without input
+    """
+    return [
+        (item["Name"], d["detector_id"], d["version"], fingerprints[item["Name"]])
+        for item in items
+        for d in detectors
+        if fingerprints[item["Name"]] is not None
+    ]
 
-    scene_metadata_df = scene_metadata(detected_scenes)
 
-    write_results_dynamo(
-        scene_metadata_df,
-        output_dynamo_table
-    )
+def write_cache(spark, output_bucket, entries):
+    spark.createDataFrame(entries, schema=CACHE_SCHEMA).coalesce(1).write.mode("append") \
+        .parquet(table_path(output_bucket, CACHE_TABLE))
+
+
+def stale_detectors(batch_metadata, fingerprints, cache, detectors=SCENE_DETECTORS):
+    """
+    Bags grouped by the detectors whose cached results are missing or out of date for them,
+    leaving out bags without input
+    """
+    groups = {}
+    for item in batch_metadata:
+        fingerprint = fingerprints.get(item["Name"])
+        if fingerprint is None:
+            print(f"Skipping {item['Name']}: no synchronized input")
+            continue
+        stale = tuple(
+            d["detector_id"] for d in detectors
+            if (item["Name"], d["detector_id"], d["version"], fingerprint) not in cache
+        )
+        if stale:
+            groups.setdefault(stale, []).append(item)
+    return groups
+
+
+def main(batch_metadata_table_name, batch_id, input_bucket, output_bucket, output_dynamo_table, spark, input_format="dense", min_duration_ns=0, merge_gap_ns=0, dynamo_endpoint_url=None, use_cache=True, batch_metadata=None):
+    # Load files to process
+    if batch_metadata is None:
+        batch_metadata = get_batch_file_metadata(
+            table_name=batch_metadata_table_name,
+            batch_id=batch_id
+        )
+
+    input_table = "synchronized_topic_changes" if input_format == "changes" else "synchronized_topics"
+    bag_files = [item["Name"] for item in batch_metadata]
+    fingerprints = input_fingerprints(spark, input_bucket, input_table, bag_files)
+    # Without the cache every detector is rerun, and the cache is refreshed with the results
+    cache = cached_detections(spark, output_bucket, bag_files) if use_cache else set()
+    groups = stale_detectors(batch_metadata, fingerprints, cache)
+
+    # Each bag is read once, together with the other bags needing the same detectors
+    for detector_ids, items in groups.items():
+        detectors = [d for d in SCENE_DETECTORS if d["detector_id"] in detector_ids]
+
+        # Load topic data from s3 and union
+        if input_format == "changes":
+            topic_changes = load_data(spark, input_bucket, batch_metadata=items, table_name=input_table)
+            synchronized_data = expand_to_grid(topic_changes, topics=list(required_topic_columns(detectors)))
+        else:
+            synchronized_data = load_data(spark, input_bucket, batch_metadata=items, table_name=input_table)
+        process_synchronized_data(synchronized_data, output_bucket, output_dynamo_table, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns, dynamo_endpoint_url=dynamo_endpoint_url, detectors=detectors)
+
+        write_cache(spark, output_bucket, cache_entries(items, fingerprints, detectors))
 
 
 if __name__ == "__main__":
@@ -258,6 +359,7 @@ if __name__ == "__main__":
     spark = SparkSession.builder.appName("scene-detection").getOrCreate()
 
     sc = spark.sparkContext
+    metrics_listener = register_metrics_listener(spark)
 
     arguments = parse_arguments(sys.argv[1:])
     batch_metadata_table_name = arguments.batch_metadata_table_name
@@ -266,5 +368,19 @@ if __name__ == "__main__":
     output_bucket = arguments.output_bucket
     output_dynamo_table = arguments.output_dynamo_table
 
-    main(batch_metadata_table_name, batch_id, input_bucket, output_bucket, output_dynamo_table, spark)
+    try:
+        main(
+            batch_metadata_table_name, batch_id, input_bucket, output_bucket, output_dynamo_table, spark,
+            input_format=arguments.input_format,
+            use_cache=not arguments.recompute,
+            **detection_options(arguments)
+        )
+    finally:
+        write_metrics(
+            spark,
+            metrics_listener,
+            batch_id=batch_id,
+            application="scene-detection",
+            path=table_path(arguments.metrics_bucket or output_bucket, "spark_job_metrics")
+        )
     sc.stop()
@@ -0,0 +1,139 @@
+"""
+DynamoDB writer for Spark DataFrames using boto3 batch_write_item from the executors.
+
+Every partition writes its rows in batches of 25 items, the batch_write_item limit. Unprocessed
+items and throttled requests are retried with exponential backoff and full jitter. The write rate
+of a partition adapts to throttling by additive increase / multiplicative decrease (AIMD). It
+grows by RATE_INCREASE items per second after every fully written batch and is halved whenever
+DynamoDB pushes back. The DataFrame is coalesced to max_writers partitions, which bounds the number
+of concurrent writers against the table.
+
+endpoint_url points the writer at a local DynamoDB stand-in such as DynamoDB Local.
+"""
+import random
+import time
+from decimal import Decimal
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+BATCH_SIZE = 25
+MAX_WRITERS = 8
+INITIAL_RATE = 200.0
+MIN_RATE = 5.0
+RATE_INCREASE = 25.0
+RATE_DECREASE = 0.5
+BASE_BACKOFF_SECS = 0.05
+MAX_BACKOFF_SECS = 10.0
+MAX_ATTEMPTS = 10
+
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+
+
+def to_attribute_value(value):
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, (int, float, Decimal)):
+        return {"N": str(Decimal(str(value)))}
+    if isinstance(value, (list, tuple)):
+        return {"L": [to_attribute_value(v) for v in value]}
+    if isinstance(value, dict):
+        return {"M": {k: to_attribute_value(v) for k, v in value.items() if v is not None}}
+    return {"S": str(value)}
+
+
+def to_dynamo_item(record):
+    """
+    DynamoDB item of a row dict, leaving out null and NaN fields
+    """
+    return {
+        k: to_attribute_value(v)
+        for k, v in record.items()
+        if v is not None and not (isinstance(v, float) and v != v)
+    }
+
+
+def backoff_secs(attempt):
+    return random.uniform(0, min(MAX_BACKOFF_SECS, BASE_BACKOFF_SECS * 2 ** attempt))
+
+
+class RateLimiter:
+    """
+    AIMD items per second limit of one writer
+    """
+
+    def __init__(self, rate=INITIAL_RATE):
+        self.rate = rate
+        self.next_send = time.monotonic()
+
+    def wait(self, num_items):
+        now = time.monotonic()
+        if self.next_send > now:
+            time.sleep(self.next_send - now)
+        self.next_send = max(now, self.next_send) + num_items / self.rate
+
+    def increase(self):
+        self.rate += RATE_INCREASE
+
+    def decrease(self):
+        self.rate = max(MIN_RATE, self.rate * RATE_DECREASE)
+
+
+def write_batch(client, table_name, requests, limiter):
+    """
+    Write one batch of put requests, retrying unprocessed items until all are written
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.wait(len(requests))
+        try:
+            response = client.batch_write_item(RequestItems={table_name: requests})
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                raise
+            limiter.decrease()
+            time.sleep(backoff_secs(attempt))
+            continue
+
+        requests = response.get("UnprocessedItems", {}).get(table_name, [])
+        if not requests:
+            limiter.increase()
+            return
+        limiter.decrease()
+        time.sleep(backoff_secs(attempt))
+
+    raise RuntimeError(
+        f"{len(requests)} items not written to {table_name} after {MAX_ATTEMPTS} attempts"
+    )
+
+
+def write_partition(rows, table_name, region, endpoint_url=None):
+    client = boto3.client(
+        "dynamodb",
+        region_name=region,
+        endpoint_url=endpoint_url,
+        # Throttling is handled by write_batch, which also slows the writer down
+        config=Config(retries={"mode": "standard", "max_attempts": 1}),
+    )
+    limiter = RateLimiter()
+    requests = []
+    for row in rows:
+        requests.append({"PutRequest": {"Item": to_dynamo_item(row.asDict())}})
+        if len(requests) == BATCH_SIZE:
+            write_batch(client, table_name, requests, limiter)
+            requests = []
+    if requests:
+        write_batch(client, table_name, requests, limiter)
+
+
+def write_dynamo(df, table_name, region="eu-west-1", endpoint_url=None, max_writers=MAX_WRITERS):
+    """
+    Put every row of df into the DynamoDB table, with at most max_writers partitions writing at once
+    """
+    df.coalesce(max_writers).foreachPartition(
+        lambda rows: write_partition(rows, table_name, region, endpoint_url)
+    )
@@ -0,0 +1,168 @@
+"""
+Extract the raw topic data of detected scenes from bag_parquets into per-scene clips.
+
+A scene id is looked up in the scene index (scene_index.py) for its bag and time interval. Every
+topic file of the bag is opened, only the row groups whose Time_ns min/max statistics overlap the
+scene are read, and the scene's rows are written to scene_clips/scene_id=<scene_id>/<topic>.parquet.
+The extraction service writes row groups of ROW_GROUP_NS each, so the data read grows with the
+length of the clip rather than the length of the bag.
+
+    python extract_clips.py --scenes-bucket my-scenes --bag-parquets-uri s3://my-dest \\
+        --clips-bucket my-scenes --scene-ids bag_a_PersonInLane_1.6080473005E9
+"""
+import argparse
+import sys
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from common import NANOS_PER_SEC, table_path
+from scene_index import query
+
+# Scene ids carry the start time as a Spark double string, which rounds it below a microsecond
+START_TIME_TOLERANCE_NS = 1_000
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenes-bucket", required=True)
+    parser.add_argument(
+        "--bag-parquets-uri",
+        required=True,
+        help="Location of the extracted <topic>/bag_file=<bag_file>/ directories, e.g. s3://my-dest",
+    )
+    parser.add_argument("--clips-bucket", required=True)
+    parser.add_argument("--scene-ids", required=True, help="Comma separated scene ids")
+    parser.add_argument("--padding-secs", type=float, default=0)
+    return parser.parse_args(args=args)
+
+
+def scene_interval(scenes_bucket, scene_id):
+    """
+    (bag_file, start_time_ns, end_time_ns) of a scene, open scenes ending with their bag
+    """
+    bag_file, _, start_time = scene_id.rsplit("_", 2)
+    start_ns = round(float(start_time) * NANOS_PER_SEC)
+    dfs = query(
+        scenes_bucket,
+        "scene_index_by_start",
+        bag_file,
+        start_ns - START_TIME_TOLERANCE_NS,
+        start_ns + START_TIME_TOLERANCE_NS,
+    )
+    for df in dfs:
+        matches = df[df["scene_id"] == scene_id]
+        if len(matches):
+            scene = matches.iloc[0]
+            return bag_file, int(scene["start_time_ns"]), int(scene["interval_end_ns"])
+    raise ValueError(f"Scene {scene_id} is not in the scene index of {scenes_bucket}")
+
+
+def bag_topic_files(bag_parquets_uri, bag_file):
+    """
+    Parquet files of every extracted topic of the bag, keyed by topic, without the grid aligned copies
+    """
+    filesystem, root = fs.FileSystem.from_uri(bag_parquets_uri)
+    topic_files = {}
+    for topic_dir in filesystem.get_file_info(fs.FileSelector(root)):
+        topic = topic_dir.base_name
+        if topic_dir.type != fs.FileType.Directory or topic.endswith("_grid"):
+            continue
+        files = filesystem.get_file_info(
+            fs.FileSelector(f"{topic_dir.path}/bag_file={bag_file}", allow_not_found=True)
+        )
+        paths = sorted(
+            f.path for f in files if f.type == fs.FileType.File and f.path.endswith((".parq", ".parquet"))
+        )
+        if paths:
+            topic_files[topic] = paths
+    return filesystem, topic_files
+
+
+def overlapping_row_groups(metadata, col_idx, start, end):
+    """
+    Row groups whose statistics of the column overlap [start, end), all of them without statistics
+    """
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(col_idx).statistics
+        if stats is not None and stats.has_min_max and (stats.max < start or stats.min >= end):
+            continue
+        row_groups.append(i)
+    return row_groups
+
+
+def read_time_range(filesystem, path, start_ns, end_ns):
+    """
+    Rows of a topic file with start_ns <= Time_ns < end_ns, and the number of row groups read and in the file
+    """
+    parquet_file = pq.ParquetFile(filesystem.open_input_file(path))
+    names = parquet_file.schema_arrow.names
+    # Files extracted before Time_ns was added only carry Time in seconds
+    if "Time_ns" in names:
+        time_col, start, end = "Time_ns", start_ns, end_ns
+    else:
+        time_col, start, end = "Time", start_ns / NANOS_PER_SEC, end_ns / NANOS_PER_SEC
+
+    row_groups = overlapping_row_groups(
+        parquet_file.metadata, names.index(time_col), start, end
+    )
+    num_row_groups = parquet_file.metadata.num_row_groups
+    if not row_groups:
+        return None, 0, num_row_groups
+
+    table = parquet_file.read_row_groups(row_groups)
+    time = table.column(time_col)
+    mask = pc.and_(pc.greater_equal(time, start), pc.less(time, end))
+    return table.filter(mask), len(row_groups), num_row_groups
+
+
+def extract_clip(scenes_bucket, bag_parquets_uri, clips_bucket, scene_id, padding_secs=0):
+    bag_file, start_ns, end_ns = scene_interval(scenes_bucket, scene_id)
+    padding_ns = int(padding_secs * NANOS_PER_SEC)
+    start_ns, end_ns = start_ns - padding_ns, end_ns + padding_ns
+
+    filesystem, topic_files = bag_topic_files(bag_parquets_uri, bag_file)
+    clip_filesystem, clip_path = fs.FileSystem.from_uri(
+        table_path(clips_bucket, f"scene_clips/scene_id={scene_id}")
+    )
+    clip_filesystem.create_dir(clip_path)
+
+    stats = {"scene_id": scene_id, "rows": 0, "row_groups_read": 0, "row_groups": 0}
+    for topic, paths in topic_files.items():
+        tables = []
+        for path in paths:
+            table, read, total = read_time_range(filesystem, path, start_ns, end_ns)
+            stats["row_groups_read"] += read
+            stats["row_groups"] += total
+            if table is not None and table.num_rows:
+                tables.append(table)
+        for i, table in enumerate(tables):
+            suffix = f"_{i}" if i else ""
+            with clip_filesystem.open_output_stream(f"{clip_path}/{topic}{suffix}.parquet") as f:
+                pq.write_table(table, f)
+            stats["rows"] += table.num_rows
+    return stats
+
+
+def main(scenes_bucket, bag_parquets_uri, clips_bucket, scene_ids, padding_secs=0):
+    return [
+        extract_clip(scenes_bucket, bag_parquets_uri, clips_bucket, scene_id, padding_secs)
+        for scene_id in scene_ids
+    ]
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+    for clip_stats in main(
+        arguments.scenes_bucket,
+        arguments.bag_parquets_uri,
+        arguments.clips_bucket,
+        [s for s in arguments.scene_ids.split(",") if s],
+        padding_secs=arguments.padding_secs,
+    ):
+        print(
+            f"{clip_stats['scene_id']}: {clip_stats['rows']} rows from "
+            f"{clip_stats['row_groups_read']} of {clip_stats['row_groups']} row groups"
+        )
@@ -0,0 +1,120 @@
+"""
+Lane geometry used by the scene detectors, shared by the Spark and local engines
+
+Each lane is indexed as a polyline sorted by image y. A lane's x at any y is found by binary
+search and linear interpolation between its two neighbouring points, and a point is in a lane
+when it lies between two lanes that are adjacent at its y. All corners of all objects in a frame
+are tested against all lanes of the frame at once with NumPy array operations.
+"""
+import functools
+import json
+
+import numpy
+
+# Distinct lane payloads kept parsed per Python worker. Synchronization forward fills the lane
+# topic, so consecutive rows mostly repeat the payload of the last lane message.
+LANE_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=LANE_CACHE_SIZE)
+def parse_lanes(lane_points):
+    """
+    Image points of every lane in a synchronized lane payload, as one (n, 2) x/y array per lane
+    sorted by y, None for lanes without points
+
+    Results are cached by payload and shared between rows, the arrays are read only
+    """
+    v = json.loads(lane_points)['lanes_clean']
+    lanes = json.loads(v)
+
+    lane_arrays = []
+    for lane in lanes:
+        img_pts = lane.get('image_points') if lane else None
+        if img_pts:
+            lane = numpy.array([(pt['x'], pt['y']) for pt in img_pts], dtype=float)
+            lane = lane[numpy.argsort(lane[:, 1], kind="stable")]
+            lane.setflags(write=False)
+            lane_arrays.append(lane)
+        else:
+            lane_arrays.append(None)
+    return tuple(lane_arrays)
+
+
+def object_corners(objects):
+    """
+    (4 * len(objects), 2) array of bbox corners, four consecutive rows per object in the order
+    (x_min, y_min), (x_max, y_min), (x_min, y_max), (x_max, y_max)
+    """
+    boxes = numpy.array(
+        [(o['x'], o['y'], o['width'], o['height']) for o in objects], dtype=float
+    ).reshape(-1, 4)
+    half_w = boxes[:, 2] / 2
+    half_h = boxes[:, 3] / 2
+    x_min, x_max = boxes[:, 0] - half_w, boxes[:, 0] + half_w
+    y_min, y_max = boxes[:, 1] - half_h, boxes[:, 1] + half_h
+    corners = numpy.stack(
+        [
+            numpy.stack([x_min, y_min], axis=1),
+            numpy.stack([x_max, y_min], axis=1),
+            numpy.stack([x_min, y_max], axis=1),
+            numpy.stack([x_max, y_max], axis=1),
+        ],
+        axis=1,
+    )
+    return corners.reshape(-1, 2)
+
+
+def lane_x_at(y, lanes):
+    """
+    (n_points, n_lanes) x of every lane at each image y, interpolated along the y sorted polyline
+
+    Above its first or below its last point a lane keeps the x of that end point. NaN for lanes
+    without points.
+    """
+    lane_x = numpy.full((len(y), len(lanes)), numpy.nan)
+    for idx, lane in enumerate(lanes):
+        if lane is not None:
+            lane_x[:, idx] = numpy.interp(y, lane[:, 1], lane[:, 0])
+    return lane_x
+
+
+def corner_lanes(corners, lanes):
+    """
+    Indices (left, right) of the lanes adjacent at each corner's y that bracket the corner's x,
+    (-1, -1) for corners outside every lane
+    """
+    lane_x = lane_x_at(corners[:, 1], lanes)
+    # Lanes ordered left to right at each corner's y, lanes without points (NaN) sorted last
+    order = numpy.argsort(lane_x, axis=1, kind="stable")
+    sorted_x = numpy.take_along_axis(lane_x, order, axis=1)
+    num_lanes = (~numpy.isnan(lane_x)).sum(axis=1)
+    num_left = (sorted_x <= corners[:, 0, None]).sum(axis=1)
+
+    in_lane = (num_left >= 1) & (num_left < num_lanes)
+    rows = numpy.arange(len(corners))
+    left = numpy.where(in_lane, order[rows, (num_left - 1).clip(0)], -1)
+    right = numpy.where(in_lane, order[rows, num_left.clip(max=len(lanes) - 1)], -1)
+    return numpy.stack([left, right], axis=1)
+
+
+def objects_in_lane(objects, lanes):
+    """
+    (corners_in_lane, lanes) of every object, each lane the (left, right) indices of the lane
+    points bounding it, in corner order
+    """
+    if not objects or len(lanes) < 2:
+        return [(0, []) for _ in objects]
+    corner_lane_idx = corner_lanes(object_corners(objects), lanes).reshape(-1, 4, 2)
+
+    results = []
+    for object_lane_idx in corner_lane_idx:
+        object_lanes = []
+        for left, right in object_lane_idx[object_lane_idx[:, 0] >= 0].tolist():
+            if (left, right) not in object_lanes:
+                object_lanes.append((left, right))
+        results.append((int((object_lane_idx[:, 0] >= 0).sum()), object_lanes))
+    return results
+
+
+def is_object_in_lane(obj, lane_points):
+    return objects_in_lane([obj], parse_lanes(lane_points))[0]
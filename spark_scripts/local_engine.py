@@ -0,0 +1,434 @@
+"""
+Single node pandas implementation of synchronize_topics.py and detect_scenes.py, for benchmarks.
+
+Exposes the same synchronize_topics / detect_scenes / scene_metadata steps as the Spark jobs, so
+a batch can be processed on one machine without launching an EMR cluster, and the two engines
+can be benchmarked and checked against each other on the same inputs. The pipeline itself always
+runs the Spark jobs.
+"""
+import argparse
+import json
+import sys
+from decimal import Decimal
+
+import boto3
+import numpy
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from common import (
+    BAG_COLS,
+    DETECTIONS_TABLE,
+    KEY_COLS,
+    NANOS_PER_SEC,
+    TIME_INTERVAL_NS,
+    get_batch_file_metadata,
+    table_path,
+)
+from scene_detectors import (
+    SCENE_DETECTORS,
+    required_topic_columns,
+    run_detectors,
+    topics_analyzed,
+)
+from scene_index import INDEX_COLUMNS, update_index
+
+# Same types as detect_scenes.DETECTIONS_TYPE
+DETECTIONS_TYPE = pa.list_(
+    pa.struct(
+        [
+            ("Class", pa.string()),
+            ("x", pa.float64()),
+            ("y", pa.float64()),
+            ("width", pa.float64()),
+            ("height", pa.float64()),
+            ("corners_in_lane", pa.int32()),
+            ("lanes", pa.list_(pa.struct([("left_lane", pa.int32()), ("right_lane", pa.int32())]))),
+        ]
+    )
+)
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-metadata-table-name")
+    parser.add_argument("--batch-id")
+    parser.add_argument(
+        "--batch-metadata-file",
+        help="JSON list of batch items to process instead of querying the batch metadata table",
+    )
+    parser.add_argument("--synchronized-bucket", required=True)
+    parser.add_argument("--scenes-bucket", required=True)
+    parser.add_argument("--output-dynamo-table")
+    parser.add_argument("--all-columns", action="store_true")
+    parser.add_argument("--min-scene-secs", type=float, default=0)
+    parser.add_argument("--merge-gap-secs", type=float, default=0)
+    return parser.parse_args(args=args)
+
+
+def read_parquet(uri, columns=None):
+    filesystem, path = fs.FileSystem.from_uri(uri)
+    parquet_file = pq.ParquetFile(filesystem.open_input_file(path))
+    if columns is not None:
+        columns = [c for c in parquet_file.schema_arrow.names if c in KEY_COLS or c in columns]
+    # Integer columns with nulls stay integers, as they are in Spark's payloads
+    return parquet_file.read(columns=columns).to_pandas(integer_object_nulls=True)
+
+
+def load_file_path(file_path, topic, bag_file, columns=None):
+    df = read_parquet(file_path, columns=columns)
+    if "Time_ns" not in df.columns:
+        df["Time_ns"] = (df["Time"] * NANOS_PER_SEC).round().astype("int64")
+    df["topic"] = topic
+    df["bag_file"] = bag_file
+    return df
+
+
+def load_and_union_data(batch_metadata, col_selection_dict=None):
+    distinct_topics = set()
+    for item in batch_metadata:
+        for t in item["topics"]:
+            distinct_topics.add(t)
+    if col_selection_dict is not None:
+        distinct_topics = distinct_topics.intersection(col_selection_dict)
+
+    topic_dfs = {}
+    for topic in distinct_topics:
+        dfs = [
+            load_file_path(
+                file,
+                topic=topic,
+                bag_file=bag_file["Name"],
+                columns=None if col_selection_dict is None else col_selection_dict[topic],
+            )
+            for bag_file in batch_metadata
+            for file in bag_file["files"]
+            if topic in file
+        ]
+        topic_dfs[topic] = pd.concat(dfs, ignore_index=True)
+
+    return topic_dfs
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and numpy.isnan(value))
+
+
+def _json_default(value):
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+
+def _json_value(value):
+    if isinstance(value, float):
+        return spark_double_str(value)
+    return json.dumps(value, default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def create_json_payload(df, non_json_cols):
+    """
+    Same payload as Spark's to_json(struct(...)): compact, non-ASCII characters unescaped, doubles
+    formatted as Spark formats them and null fields left out
+    """
+    json_cols = [c for c in df.columns if c not in non_json_cols]
+    payload = [
+        "{"
+        + ",".join(
+            f"{json.dumps(k, ensure_ascii=False)}:{_json_value(v)}"
+            for k, v in record.items()
+            if not _is_null(v)
+        )
+        + "}"
+        for record in df[json_cols].to_dict("records")
+    ]
+    return df[[c for c in df.columns if c in non_json_cols]].assign(payload=payload)
+
+
+def synchronize_topics(topic_data, time_interval_ns=TIME_INTERVAL_NS):
+    """
+    Forward fill every topic onto each bag's time grid
+
+    The value at a tick is the first message at the latest Time_ns at or before the tick,
+    found with a binary search over the bag's sorted message times
+    """
+    topics = list(topic_data.keys())
+    signals = {
+        topic: create_json_payload(df, non_json_cols=KEY_COLS + ["bag_file"])
+        .sort_values("Time_ns", kind="stable")
+        .drop_duplicates(subset=BAG_COLS + ["Time_ns"])
+        for topic, df in topic_data.items()
+    }
+    signals_by_bag = {
+        topic: {bag: df for bag, df in signal_df.groupby(BAG_COLS)}
+        for topic, signal_df in signals.items()
+    }
+    bag_extents = (
+        pd.concat([df[BAG_COLS + ["Time_ns"]] for df in signals.values()])
+        .groupby(BAG_COLS)["Time_ns"]
+        .agg(["min", "max"])
+    )
+
+    synchronized_dfs = []
+    for bag, extent in bag_extents.iterrows():
+        first_tick = extent["min"] // time_interval_ns
+        last_tick = extent["max"] // time_interval_ns
+        if last_tick <= first_tick:
+            continue
+        ticks = numpy.arange(first_tick, last_tick, dtype="int64") * time_interval_ns
+
+        bag_df = pd.DataFrame(
+            {
+                "bag_file": bag[0],
+                "bag_file_prefix": bag[1],
+                "bag_file_bucket": bag[2],
+                "Time": ticks / NANOS_PER_SEC,
+                "Time_ns": ticks,
+            }
+        )
+        for topic in topics:
+            topic_df = signals_by_bag[topic].get(bag)
+            clean = numpy.full(len(ticks), None, dtype=object)
+            if topic_df is not None:
+                idx = numpy.searchsorted(topic_df["Time_ns"].values, ticks, side="right") - 1
+                found = idx >= 0
+                clean[found] = topic_df["payload"].values[idx[found]]
+            bag_df[f"{topic}_clean"] = pd.Series(clean, dtype=object)
+        synchronized_dfs.append(bag_df)
+
+    return pd.concat(synchronized_dfs, ignore_index=True)
+
+
+def detect_scenes(synchronized_data):
+    keys = synchronized_data[["Time", "Time_ns"] + BAG_COLS]
+    detected = pd.concat(
+        [keys.join(detections) for detections in run_detectors(synchronized_data)],
+        ignore_index=True,
+    )
+    return detected[
+        ["Time", "Time_ns", "detector_id", "detections", "scene_signal"] + BAG_COLS
+    ].astype({"scene_signal": "Int64"})
+
+
+def spark_double_str(value):
+    """
+    Format a float the way Spark casts a double to string, so scene ids match the Spark engine
+    """
+    if value == 0 or 1e-3 <= abs(value) < 1e7:
+        return repr(float(value))
+    mantissa, exponent = numpy.format_float_scientific(value, unique=True, trim="0").split("e")
+    return f"{mantissa}E{int(exponent)}"
+
+
+def segment_scenes(df, signal_col, partition_cols=BAG_COLS, min_duration_ns=0, merge_gap_ns=0):
+    """
+    Same gaps-and-islands segmentation as scene_segments.segment_scenes
+    """
+    ticks = df[df[signal_col].notna()].sort_values(partition_cols + ["Time_ns"], kind="stable")
+    ticks = ticks.assign(signal=ticks[signal_col].astype("int64"), active=ticks[signal_col] > 0)
+    new_partition = (ticks[partition_cols] != ticks[partition_cols].shift()).any(axis=1)
+    ticks = ticks.assign(
+        island=(new_partition | (ticks["active"] != ticks["active"].shift())).cumsum()
+    )
+
+    islands = ticks.groupby("island", sort=True).agg(
+        **{c: (c, "first") for c in partition_cols},
+        active=("active", "first"),
+        start_time=("Time", "min"),
+        start_time_ns=("Time_ns", "min"),
+        signal_start=("signal", "first"),
+        signal_max=("signal", "max"),
+        signal_sum=("signal", "sum"),
+        num_ticks=("signal", "count"),
+    )
+    by_partition = islands.groupby(partition_cols, sort=False)
+    # An active island ends where the following inactive island starts
+    islands = islands.assign(
+        first_island=by_partition.cumcount() == 0,
+        end_time=by_partition["start_time"].shift(-1),
+        end_time_ns=by_partition["start_time_ns"].shift(-1).astype("Int64"),
+    )
+
+    active_islands = islands[islands["active"]]
+    gap_ns = active_islands["start_time_ns"] - active_islands.groupby(partition_cols, sort=False)[
+        "end_time_ns"
+    ].shift(1)
+    merged = (gap_ns.notna() & (gap_ns <= merge_gap_ns)).fillna(False).astype(bool)
+    scenes = active_islands.assign(scene=(~merged).cumsum()).groupby("scene", sort=True).agg(
+        **{c: (c, "first") for c in partition_cols},
+        first_island=("first_island", "first"),
+        start_time=("start_time", "min"),
+        start_time_ns=("start_time_ns", "min"),
+        end_time=("end_time", "max"),
+        end_time_ns=("end_time_ns", "max"),
+        num_ends=("end_time_ns", "count"),
+        num_islands=("end_time_ns", "size"),
+        signal_start=("signal_start", "first"),
+        signal_max=("signal_max", "max"),
+        signal_sum=("signal_sum", "sum"),
+        num_ticks=("num_ticks", "sum"),
+    )
+    # only the last island of a bag can be open, which leaves the merged scene open too
+    closed = scenes["num_ends"] == scenes["num_islands"]
+    scenes = scenes.assign(
+        end_time=scenes["end_time"].where(closed),
+        end_time_ns=scenes["end_time_ns"].astype("Int64").where(closed),
+        **{f"{signal_col}_avg": scenes["signal_sum"] / scenes["num_ticks"]},
+    ).rename(columns={"signal_start": f"{signal_col}_start", "signal_max": f"{signal_col}_max"})
+
+    duration_ns = scenes["end_time_ns"] - scenes["start_time_ns"]
+    keep = ~scenes["first_island"] & (duration_ns.isna() | (duration_ns >= min_duration_ns)).fillna(True)
+    return scenes[keep.astype(bool)][
+        partition_cols
+        + [
+            "start_time",
+            "end_time",
+            "start_time_ns",
+            "end_time_ns",
+            f"{signal_col}_start",
+            f"{signal_col}_max",
+            f"{signal_col}_avg",
+        ]
+    ].reset_index(drop=True)
+
+
+def summarize_scenes(df, detector, min_duration_ns=0, merge_gap_ns=0):
+    signal_name = detector["signal_name"]
+    detections = df[df["detector_id"] == detector["detector_id"]].rename(
+        columns={"scene_signal": signal_name}
+    )
+    summary = segment_scenes(
+        detections, signal_name, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns
+    )
+    return summary.assign(
+        detector_id=detector["detector_id"],
+        scene_id=summary["bag_file"]
+        + f"_{detector['detector_id']}_"
+        + summary["start_time"].map(spark_double_str).astype(str),
+        scene_length=(summary["end_time_ns"] - summary["start_time_ns"]) / NANOS_PER_SEC,
+        topics_analyzed=topics_analyzed(detector),
+    )
+
+
+def scene_metadata(df, min_duration_ns=0, merge_gap_ns=0):
+    return pd.concat(
+        [
+            summarize_scenes(
+                df, detector, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns
+            )
+            for detector in SCENE_DETECTORS
+        ],
+        ignore_index=True,
+    )
+
+
+def write_results(df, table_name, output_bucket, partition_cols=[], overwrite_partitions=False):
+    filesystem, path = fs.FileSystem.from_uri(table_path(output_bucket, table_name))
+    if overwrite_partitions:
+        # Replace only the partitions df writes to, like Spark's dynamic partition overwrite
+        for values in df[partition_cols].drop_duplicates().itertuples(index=False):
+            partition = "/".join(f"{c}={v}" for c, v in zip(partition_cols, values))
+            if filesystem.get_file_info(f"{path}/{partition}").type == fs.FileType.Directory:
+                filesystem.delete_dir(f"{path}/{partition}")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if "detections" in table.column_names:
+        table = table.set_column(
+            table.column_names.index("detections"),
+            "detections",
+            pa.array(df["detections"].tolist(), type=DETECTIONS_TYPE),
+        )
+    pq.write_to_dataset(
+        table,
+        path,
+        partition_cols=partition_cols,
+        filesystem=filesystem,
+    )
+
+
+def write_scene_index(scene_metadata_df, detected_scenes, output_bucket):
+    bag_end = detected_scenes.groupby("bag_file")["Time_ns"].max().rename("bag_end_ns")
+    index = scene_metadata_df.join(bag_end, on="bag_file")
+    interval_end = index["end_time_ns"].fillna(index["bag_end_ns"]).astype("int64")
+    index = index.assign(
+        interval_end_ns=interval_end,
+        interval_length_ns=interval_end - index["start_time_ns"].astype("int64"),
+    )[INDEX_COLUMNS]
+    # Replace the scenes previously detected for the same bags and detectors
+    detected_pairs = detected_scenes[["bag_file", "detector_id"]].drop_duplicates()
+    update_index(output_bucket, index, replaced_pairs=detected_pairs.itertuples(index=False, name=None))
+
+
+def write_results_dynamo(df, output_dynamo_table):
+    dynamodb = boto3.resource("dynamodb", region_name="eu-west-1")
+    table = dynamodb.Table(output_dynamo_table)
+    with table.batch_writer() as batch:
+        for record in df.to_dict("records"):
+            batch.put_item(
+                Item={
+                    k: Decimal(str(v)) if isinstance(v, float) else v
+                    for k, v in record.items()
+                    if not _is_null(v) and v is not pd.NA
+                }
+            )
+
+
+def main(
+    batch_metadata,
+    synchronized_bucket,
+    scenes_bucket,
+    output_dynamo_table=None,
+    all_columns=False,
+    min_duration_ns=0,
+    merge_gap_ns=0,
+):
+    col_selection_dict = None if all_columns else required_topic_columns()
+    topic_data = load_and_union_data(batch_metadata, col_selection_dict)
+    synchronized_df = synchronize_topics(topic_data)
+    write_results(
+        synchronized_df,
+        table_name="synchronized_topics",
+        output_bucket=synchronized_bucket,
+        partition_cols=["bag_file"],
+    )
+
+    detected_scenes = detect_scenes(synchronized_df)
+    write_results(
+        detected_scenes,
+        table_name=DETECTIONS_TABLE,
+        output_bucket=scenes_bucket,
+        partition_cols=["bag_file", "detector_id"],
+        overwrite_partitions=True,
+    )
+
+    scene_metadata_df = scene_metadata(
+        detected_scenes, min_duration_ns=min_duration_ns, merge_gap_ns=merge_gap_ns
+    )
+    write_scene_index(scene_metadata_df, detected_scenes, scenes_bucket)
+    if output_dynamo_table:
+        write_results_dynamo(scene_metadata_df, output_dynamo_table)
+    return scene_metadata_df
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+    if arguments.batch_metadata_file:
+        with open(arguments.batch_metadata_file) as f:
+            batch_metadata = json.load(f)
+    else:
+        batch_metadata = get_batch_file_metadata(
+            table_name=arguments.batch_metadata_table_name, batch_id=arguments.batch_id
+        )
+
+    main(
+        batch_metadata,
+        synchronized_bucket=arguments.synchronized_bucket,
+        scenes_bucket=arguments.scenes_bucket,
+        output_dynamo_table=arguments.output_dynamo_table,
+        all_columns=arguments.all_columns,
+        min_duration_ns=int(arguments.min_scene_secs * NANOS_PER_SEC),
+        merge_gap_ns=int(arguments.merge_gap_secs * NANOS_PER_SEC),
+    )
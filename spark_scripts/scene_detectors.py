@@ -0,0 +1,177 @@
+"""
+Registry of the scene detectors run by detect_scenes.py.
+
+A detector is a dict with
+    detector_id   name stored with its detections and scenes, and part of the scene ids
+    version       bumped whenever the detector's output changes
+    inputs        topic columns it reads, keyed by topic
+    detect        Arrow batch function, given a pandas DataFrame with the {topic}_clean column of
+                  every input topic it returns one list of detected objects per row, or None for
+                  rows where the detector cannot run. Objects are dicts with the
+                  DETECTED_OBJECT_FIELDS, see detected_object
+    signal_name   name of the per tick scene signal
+    scene_signal  function from a row's detected objects to the scene signal, a number that is
+                  above 0 while the scene lasts
+
+synchronize_topics.py only loads the columns declared in inputs, so a detector that needs another
+field must declare it before that field is carried through synchronization. All registered
+detectors run over a single scan of the synchronized topics.
+
+The per-row detection functions take plain dicts, so both the Spark and the local engine run them.
+"""
+import json
+
+import pandas as pd
+
+from lane_geometry import objects_in_lane, parse_lanes
+
+DETECTOR_KEYS = ["detector_id", "version", "inputs", "detect", "signal_name", "scene_signal"]
+
+# Fields of every detected object, typed in detect_scenes.DETECTED_OBJECT_TYPE
+DETECTED_OBJECT_FIELDS = ["Class", "x", "y", "width", "height", "corners_in_lane", "lanes"]
+
+
+# Camera detections and the lane points found in the same camera's images, keyed by camera
+CAMERA_LANE_TOPICS = {
+    "right": ("rgb_right_detections_only", "post_process_lane_points_rgb_front_right"),
+    "left": ("rgb_left_detections_only", "post_process_lane_points_rgb_front_left"),
+}
+
+
+def person_in_lane_detector(detector_id, detections_topic, lanes_topic):
+    """
+    PersonInLane detector of one camera, reading the camera's detections and lane points
+    """
+    detections_col = f"{detections_topic}_clean"
+    lanes_col = f"{lanes_topic}_clean"
+
+    def person_in_lane(pdf):
+        rows = pdf.astype(object).where(pdf.notna(), None).to_dict("records")
+        return [
+            obj_in_lane_detection(row, detections_col, lanes_col)["objects_in_lane"]
+            for row in rows
+        ]
+
+    return {
+        "detector_id": detector_id,
+        "version": 2,
+        "inputs": {
+            detections_topic: ["detections_bboxes_clean"],
+            lanes_topic: ["lanes_clean"],
+        },
+        "detect": person_in_lane,
+        "signal_name": "num_people_in_scene",
+        "scene_signal": lambda objects: sum(1 for o in objects if o['Class'] == 'person'),
+    }
+
+
+# The right camera keeps the original detector id, so its scene ids are unchanged
+PERSON_IN_LANE = person_in_lane_detector("PersonInLane", *CAMERA_LANE_TOPICS["right"])
+PERSON_IN_LANE_LEFT = person_in_lane_detector("PersonInLaneLeft", *CAMERA_LANE_TOPICS["left"])
+
+SCENE_DETECTORS = []
+
+
+def register_detector(detector):
+    missing = [k for k in DETECTOR_KEYS if k not in detector]
+    if missing:
+        raise ValueError(f"Detector is missing {', '.join(missing)}")
+    if any(d["detector_id"] == detector["detector_id"] for d in SCENE_DETECTORS):
+        raise ValueError(f"Detector {detector['detector_id']} is already registered")
+    SCENE_DETECTORS.append(detector)
+    return detector
+
+
+register_detector(PERSON_IN_LANE)
+register_detector(PERSON_IN_LANE_LEFT)
+
+
+def required_topic_columns(detectors=SCENE_DETECTORS):
+    """
+    Union of the topic columns declared by detectors, keyed by topic
+    """
+    col_selection_dict = {}
+    for detector in detectors:
+        for topic, cols in detector["inputs"].items():
+            topic_cols = col_selection_dict.setdefault(topic, [])
+            for col in cols:
+                if col not in topic_cols:
+                    topic_cols.append(col)
+    return col_selection_dict
+
+
+def input_columns(detectors=SCENE_DETECTORS):
+    """
+    Synchronized columns read by detectors
+    """
+    return [f"{topic}_clean" for topic in required_topic_columns(detectors)]
+
+
+def run_detectors(pdf, detectors=SCENE_DETECTORS):
+    """
+    Run every detector over one batch of synchronized rows
+
+    Returns one frame per detector with the detector_id, the detected objects and the scene signal
+    of each row, aligned with pdf's index. The scene signal is an object column of ints and None:
+    Spark 3.0 cannot pass pandas extension arrays such as Int64 through Arrow.
+    """
+    results = []
+    for detector in detectors:
+        inputs = [f"{topic}_clean" for topic in detector["inputs"]]
+        detections = detector["detect"](pdf.reindex(columns=inputs))
+        scene_signal = [
+            None if objects is None else detector["scene_signal"](objects)
+            for objects in detections
+        ]
+        results.append(
+            pd.DataFrame(
+                {
+                    "detector_id": detector["detector_id"],
+                    "detections": pd.Series(detections, index=pdf.index, dtype=object),
+                    "scene_signal": pd.Series(scene_signal, index=pdf.index, dtype=object),
+                },
+                index=pdf.index,
+            )
+        )
+    return results
+
+
+def topics_analyzed(detector):
+    """
+    Synchronized columns a detector reads, as stored with its scene metadata
+    """
+    return ",".join(f"{topic}_clean" for topic in detector["inputs"])
+
+
+def detected_object(obj, corners_in_lane, lanes):
+    """
+    Detected object with exactly the DETECTED_OBJECT_FIELDS
+    """
+    return {
+        'Class': obj['Class'],
+        'x': float(obj['x']),
+        'y': float(obj['y']),
+        'width': float(obj['width']),
+        'height': float(obj['height']),
+        'corners_in_lane': corners_in_lane,
+        'lanes': [{'left_lane': left, 'right_lane': right} for left, right in lanes],
+    }
+
+
+def obj_in_lane_detection(
+    row,
+    detections_col='rgb_right_detections_only_clean',
+    lanes_col='post_process_lane_points_rgb_front_right_clean',
+):
+    if row.get(detections_col) and row.get(lanes_col):
+        in_lane = []
+        objects = json.loads(json.loads(row[detections_col]).get('detections_bboxes_clean', []))
+        lanes = parse_lanes(row[lanes_col])
+        for o, (corners_in_lane, object_lanes) in zip(objects, objects_in_lane(objects, lanes)):
+            if corners_in_lane:
+                in_lane.append(detected_object(o, corners_in_lane, object_lanes))
+
+        row['objects_in_lane'] = in_lane
+    else:
+        row['objects_in_lane'] = None
+    return row
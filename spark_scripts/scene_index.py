@@ -0,0 +1,255 @@
+"""
+Interval index over detected scenes, and overlap and duration queries against it.
+
+Each index table is one sorted Parquet file, rewritten by every detection run with its new scenes
+merged in (update_index):
+
+    scene_index_by_start   sorted by (bag_file, start_time_ns), for time overlap queries
+    scene_index_by_length  sorted by (detector_id, scene_length), for duration queries
+
+Index rows are small and row groups are kept small, so the row group min/max statistics in a
+file's footer locate the rows of a query. Footers are read once per file and cached; the row
+groups of the queried key are found by binary search over the statistics of the sorted columns,
+and only those row groups are read.
+
+interval_end_ns is the scene's end, or the end of its bag for scenes still open when the bag ends,
+and interval_length_ns bounds how long before a query window an overlapping scene can start.
+
+    from scene_index import scenes_overlapping, scenes_longer_than
+
+    scenes_overlapping("s3://scenes-bucket", "bag_a", start_ns, end_ns)
+    scenes_longer_than("s3://scenes-bucket", "PersonInLane", 3.0)
+"""
+import bisect
+import functools
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from common import table_path
+
+INDEX_COLUMNS = [
+    "bag_file",
+    "detector_id",
+    "scene_id",
+    "start_time_ns",
+    "end_time_ns",
+    "interval_end_ns",
+    "interval_length_ns",
+    "scene_length",
+]
+
+INDEX_SCHEMA = pa.schema(
+    [
+        ("bag_file", pa.string()),
+        ("detector_id", pa.string()),
+        ("scene_id", pa.string()),
+        ("start_time_ns", pa.int64()),
+        ("end_time_ns", pa.int64()),
+        ("interval_end_ns", pa.int64()),
+        ("interval_length_ns", pa.int64()),
+        ("scene_length", pa.float64()),
+    ]
+)
+
+INDEX_TABLES = {
+    "scene_index_by_start": ["bag_file", "start_time_ns"],
+    "scene_index_by_length": ["detector_id", "scene_length"],
+}
+
+INDEX_ROW_GROUP_ROWS = 4096
+FOOTER_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=None)
+def filesystem_of(uri):
+    return fs.FileSystem.from_uri(uri)[0]
+
+
+def index_files(bucket, table_name):
+    uri = table_path(bucket, table_name)
+    path = fs.FileSystem.from_uri(uri)[1]
+    infos = filesystem_of(uri).get_file_info(
+        fs.FileSelector(path, recursive=True, allow_not_found=True)
+    )
+    return uri, sorted(
+        info.path
+        for info in infos
+        if info.type == fs.FileType.File and info.path.endswith(".parquet")
+    )
+
+
+class IndexFile:
+    """
+    Footer statistics of one index file, per row group, for its two sort columns
+    """
+
+    def __init__(self, filesystem, path, key_col, sort_col):
+        self.filesystem = filesystem
+        self.path = path
+        metadata = pq.ParquetFile(filesystem.open_input_file(path)).metadata
+        names = metadata.schema.to_arrow_schema().names
+        self.key_stats = self._stats(metadata, names.index(key_col))
+        self.sort_stats = self._stats(metadata, names.index(sort_col))
+        lengths = self._stats(metadata, names.index("interval_length_ns"))
+        # None when a row group has no statistics, overlap queries then read from the key's start
+        self.max_interval_length_ns = (
+            max(l_max for _, l_max in lengths)
+            if lengths and all(l_max is not None for _, l_max in lengths)
+            else None
+        )
+
+    @staticmethod
+    def _stats(metadata, col_idx):
+        stats = []
+        for i in range(metadata.num_row_groups):
+            s = metadata.row_group(i).column(col_idx).statistics
+            stats.append((s.min, s.max) if s is not None and s.has_min_max else (None, None))
+        return stats
+
+    def row_groups(self, key, lo=None, hi=None):
+        """
+        Row groups that can hold rows with the key and a sort value in [lo, hi]
+        """
+        if any(k_min is None for k_min, _ in self.key_stats):
+            candidates = range(len(self.key_stats))
+        else:
+            # rows are sorted by key, so the row groups holding it are contiguous
+            first = bisect.bisect_left([k_max for _, k_max in self.key_stats], key)
+            last = bisect.bisect_right([k_min for k_min, _ in self.key_stats], key)
+            candidates = range(first, last)
+
+        selected = []
+        for i in candidates:
+            s_min, s_max = self.sort_stats[i]
+            if s_min is not None and (
+                (lo is not None and s_max < lo) or (hi is not None and s_min > hi)
+            ):
+                continue
+            selected.append(i)
+        return selected
+
+    def read(self, row_groups):
+        parquet_file = pq.ParquetFile(self.filesystem.open_input_file(self.path))
+        return parquet_file.read_row_groups(row_groups, columns=INDEX_COLUMNS).to_pandas()
+
+
+def read_index_file(filesystem, path):
+    table = pq.read_table(filesystem.open_input_file(path), columns=INDEX_COLUMNS)
+    # Nanosecond timestamps with nulls stay exact integers
+    return index_frame(table.to_pandas(integer_object_nulls=True))
+
+
+def index_frame(rows):
+    """
+    Index rows with the INDEX_COLUMNS, nanosecond columns as nullable integers
+    """
+    return pd.DataFrame(rows, columns=INDEX_COLUMNS).astype(
+        {
+            "start_time_ns": "Int64",
+            "end_time_ns": "Int64",
+            "interval_end_ns": "Int64",
+            "interval_length_ns": "Int64",
+            "scene_length": "float64",
+        }
+    )
+
+
+def update_index(bucket, index_rows, replaced_pairs=()):
+    """
+    Merge index_rows into every index table and rewrite each as one sorted file
+
+    The rows already in the table are read back, less those of the (bag_file, detector_id) pairs in
+    replaced_pairs, whose scenes were detected again, and a scene_id in index_rows replaces its old
+    row, so rerunning detection on a bag neither keeps stale scenes, duplicates its scenes nor grows
+    the number of files.
+    The old files are deleted after the new one is written, a query running in between sees both.
+    Index rows are a few per scene, they are merged on the driver; detection runs writing the
+    same bucket at the same time can drop each other's rows.
+    """
+    index_rows = index_frame(index_rows)
+    replaced = set(replaced_pairs)
+    for table_name, sort_cols in INDEX_TABLES.items():
+        uri, paths = index_files(bucket, table_name)
+        filesystem = filesystem_of(uri)
+        path = fs.FileSystem.from_uri(uri)[1]
+        existing = [read_index_file(filesystem, p) for p in paths]
+        existing = [
+            df[[pair not in replaced for pair in zip(df["bag_file"], df["detector_id"])]]
+            for df in existing
+        ]
+        index = (
+            pd.concat([*existing, index_rows], ignore_index=True)
+            .drop_duplicates("scene_id", keep="last")
+            .sort_values(sort_cols, na_position="first", kind="stable")
+        )
+        filesystem.create_dir(path)
+        with filesystem.open_output_stream(f"{path}/{uuid.uuid4()}.parquet") as f:
+            pq.write_table(
+                pa.Table.from_pandas(index, schema=INDEX_SCHEMA, preserve_index=False),
+                f,
+                row_group_size=INDEX_ROW_GROUP_ROWS,
+            )
+        for p in paths:
+            filesystem.delete_file(p)
+
+
+@functools.lru_cache(maxsize=FOOTER_CACHE_SIZE)
+def index_file(uri, path, key_col, sort_col):
+    return IndexFile(filesystem_of(uri), path, key_col, sort_col)
+
+
+def query(bucket, table_name, key, lo=None, hi=None, lookback=False):
+    """
+    Rows of the index table with the key, read only from row groups whose sort column statistics
+    overlap [lo, hi]. With lookback, lo is moved back by the file's longest scene interval.
+    """
+    key_col, sort_col = INDEX_TABLES[table_name]
+    uri, paths = index_files(bucket, table_name)
+
+    dfs = []
+    for path in paths:
+        f = index_file(uri, path, key_col, sort_col)
+        file_lo = lo
+        if lookback and lo is not None:
+            file_lo = None if f.max_interval_length_ns is None else lo - f.max_interval_length_ns
+        row_groups = f.row_groups(key, file_lo, hi)
+        if row_groups:
+            df = f.read(row_groups)
+            dfs.append(df[df[key_col] == key])
+    return dfs
+
+
+def _concat(dfs, sort_cols):
+    if not dfs:
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    return pd.concat(dfs, ignore_index=True).sort_values(sort_cols, ignore_index=True)
+
+
+def scenes_overlapping(bucket, bag_file, start_time_ns, end_time_ns, detector_id=None):
+    """
+    Scenes of bag_file that overlap [start_time_ns, end_time_ns), optionally of one detector
+    """
+    dfs = query(
+        bucket, "scene_index_by_start", bag_file, start_time_ns, end_time_ns, lookback=True
+    )
+    df = _concat(dfs, ["start_time_ns", "detector_id"])
+    df = df[(df["start_time_ns"] < end_time_ns) & (df["interval_end_ns"] > start_time_ns)]
+    if detector_id is not None:
+        df = df[df["detector_id"] == detector_id]
+    return df.reset_index(drop=True)
+
+
+def scenes_longer_than(bucket, detector_id, min_length_secs, max_length_secs=None):
+    """
+    Closed scenes of detector_id lasting at least min_length_secs, and at most max_length_secs
+    """
+    dfs = query(bucket, "scene_index_by_length", detector_id, min_length_secs, max_length_secs)
+    df = _concat(dfs, ["scene_length", "bag_file"])
+    df = df[df["scene_length"] >= min_length_secs]
+    if max_length_secs is not None:
+        df = df[df["scene_length"] <= max_length_secs]
+    return df.reset_index(drop=True)
@@ -0,0 +1,97 @@
+"""
+Gaps-and-islands segmentation of a per tick scene signal into scenes.
+
+A tick is active while its signal is above 0. Consecutive active ticks form an island, numbered by a
+running count of activity changes, and every island is reduced to one interval with a groupBy, all
+in native Spark expressions. A scene starts at the first active tick after an inactive one and ends
+at the next inactive tick, or stays open (null end) when the bag ends first. Scenes already active at
+the first tick of a bag are left out, their start is unknown. Ticks with a null signal are skipped,
+so they neither start nor end a scene.
+
+    merge_gap_ns      scenes separated by at most this much inactive time are merged
+    min_duration_ns   closed scenes shorter than this are dropped after merging
+"""
+from pyspark.sql import Window
+import pyspark.sql.functions as func
+
+from common import BAG_COLS
+
+
+def segment_scenes(df, signal_col, partition_cols=BAG_COLS, min_duration_ns=0, merge_gap_ns=0):
+    """
+    Scenes of the signal in df, one row per scene with partition_cols, start_time, end_time,
+    start_time_ns, end_time_ns and the {signal_col}_start, {signal_col}_max and {signal_col}_avg
+    of the signal over the scene's active ticks
+    """
+    ticks = df.filter(func.col(signal_col).isNotNull()).select(
+        *partition_cols,
+        "Time",
+        "Time_ns",
+        func.col(signal_col).alias("signal"),
+        (func.col(signal_col) > 0).alias("active"),
+    )
+
+    w = Window.partitionBy(*partition_cols).orderBy("Time_ns")
+    prev_active = func.lag("active").over(w)
+    islands = ticks.withColumn(
+        "island",
+        func.sum(
+            func.when(prev_active.isNull() | (prev_active != func.col("active")), 1).otherwise(0)
+        ).over(w.rowsBetween(Window.unboundedPreceding, Window.currentRow)),
+    ).groupBy(*partition_cols, "island", "active").agg(
+        func.min("Time").alias("start_time"),
+        func.min("Time_ns").alias("start_time_ns"),
+        func.min(func.struct("Time_ns", "signal")).getField("signal").alias("signal_start"),
+        func.max("signal").alias("signal_max"),
+        func.sum("signal").alias("signal_sum"),
+        func.count("signal").alias("num_ticks"),
+    )
+
+    # An active island ends where the following inactive island starts
+    w_islands = Window.partitionBy(*partition_cols).orderBy("island")
+    active_islands = islands.withColumn(
+        "end_time", func.lead("start_time").over(w_islands)
+    ).withColumn(
+        "end_time_ns", func.lead("start_time_ns").over(w_islands)
+    ).filter("active")
+
+    gap_ns = func.col("start_time_ns") - func.lag("end_time_ns").over(w_islands)
+    scenes = active_islands.withColumn(
+        "scene",
+        func.sum(func.when(gap_ns.isNotNull() & (gap_ns <= merge_gap_ns), 0).otherwise(1)).over(
+            w_islands.rowsBetween(Window.unboundedPreceding, Window.currentRow)
+        ),
+    ).groupBy(*partition_cols, "scene").agg(
+        func.min("island").alias("first_island"),
+        func.min("start_time").alias("start_time"),
+        func.min("start_time_ns").alias("start_time_ns"),
+        # only the last island of a bag can be open, which leaves the merged scene open too
+        func.when(
+            func.count("end_time_ns") == func.count(func.lit(1)), func.max("end_time")
+        ).alias("end_time"),
+        func.when(
+            func.count("end_time_ns") == func.count(func.lit(1)), func.max("end_time_ns")
+        ).alias("end_time_ns"),
+        func.min(func.struct("start_time_ns", "signal_start")).getField("signal_start").alias(
+            f"{signal_col}_start"
+        ),
+        func.max("signal_max").alias(f"{signal_col}_max"),
+        (func.sum("signal_sum") / func.sum("num_ticks")).alias(f"{signal_col}_avg"),
+    )
+
+    return scenes.filter(
+        (func.col("first_island") > 1)
+        & (
+            func.col("end_time_ns").isNull()
+            | (func.col("end_time_ns") - func.col("start_time_ns") >= min_duration_ns)
+        )
+    ).select(
+        *partition_cols,
+        "start_time",
+        "end_time",
+        "start_time_ns",
+        "end_time_ns",
+        f"{signal_col}_start",
+        f"{signal_col}_max",
+        f"{signal_col}_avg",
+    )
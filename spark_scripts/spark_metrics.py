@@ -0,0 +1,203 @@
+"""
+SparkListener recording per-job and per-stage metrics of a PySpark application.
+
+The listener lives in the driver's Python process and is called through the py4j callback
+server, so no extra jar is needed on the cluster. Stage totals come from the stage's aggregated
+task metrics, skew from the executor run time of every finished task of the stage.
+"""
+import threading
+
+from pyspark.java_gateway import ensure_callback_server_started
+from pyspark.sql import types
+
+METRICS_SCHEMA = types.StructType(
+    [
+        types.StructField("batch_id", types.StringType()),
+        types.StructField("application", types.StringType()),
+        types.StructField("level", types.StringType()),
+        types.StructField("job_id", types.IntegerType()),
+        types.StructField("stage_id", types.IntegerType()),
+        types.StructField("stage_attempt", types.IntegerType()),
+        types.StructField("name", types.StringType()),
+        types.StructField("status", types.StringType()),
+        types.StructField("num_tasks", types.IntegerType()),
+        types.StructField("duration_ms", types.LongType()),
+        types.StructField("executor_run_time_ms", types.LongType()),
+        types.StructField("executor_cpu_time_ms", types.LongType()),
+        types.StructField("jvm_gc_time_ms", types.LongType()),
+        types.StructField("input_bytes", types.LongType()),
+        types.StructField("shuffle_read_bytes", types.LongType()),
+        types.StructField("shuffle_write_bytes", types.LongType()),
+        types.StructField("memory_bytes_spilled", types.LongType()),
+        types.StructField("disk_bytes_spilled", types.LongType()),
+        types.StructField("max_task_run_time_ms", types.LongType()),
+        types.StructField("mean_task_run_time_ms", types.DoubleType()),
+        types.StructField("task_skew", types.DoubleType()),
+    ]
+)
+
+STAGE_TOTALS = [
+    "executor_run_time_ms",
+    "executor_cpu_time_ms",
+    "jvm_gc_time_ms",
+    "input_bytes",
+    "shuffle_read_bytes",
+    "shuffle_write_bytes",
+    "memory_bytes_spilled",
+    "disk_bytes_spilled",
+]
+
+
+def _option(value):
+    return value.get() if value.isDefined() else None
+
+
+class StageMetricsListener:
+    """
+    Implements org.apache.spark.scheduler.SparkListenerInterface, every event not handled
+    below is ignored by __getattr__
+    """
+
+    class Java:
+        implements = ["org.apache.spark.scheduler.SparkListenerInterface"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self.stages = {}
+        self.stage_job = {}
+        self.task_run_times = {}
+
+    def __getattr__(self, name):
+        if name.startswith("on"):
+            return lambda *args: None
+        raise AttributeError(name)
+
+    def onJobStart(self, job_start):
+        stage_ids = job_start.stageIds()
+        with self._lock:
+            self.jobs[job_start.jobId()] = {
+                "job_id": job_start.jobId(),
+                "start_time": job_start.time(),
+                "name": job_start.properties().getProperty("callSite.short")
+                if job_start.properties()
+                else None,
+            }
+            for i in range(stage_ids.size()):
+                self.stage_job.setdefault(stage_ids.apply(i), job_start.jobId())
+
+    def onJobEnd(self, job_end):
+        with self._lock:
+            job = self.jobs.setdefault(job_end.jobId(), {"job_id": job_end.jobId()})
+            job["end_time"] = job_end.time()
+            job["status"] = job_end.jobResult().toString()
+
+    def onTaskEnd(self, task_end):
+        task_metrics = task_end.taskMetrics()
+        if task_metrics is None:
+            return
+        key = (task_end.stageId(), task_end.stageAttemptId())
+        run_time = task_metrics.executorRunTime()
+        with self._lock:
+            count, total, longest = self.task_run_times.get(key, (0, 0, 0))
+            self.task_run_times[key] = (count + 1, total + run_time, max(longest, run_time))
+
+    def onStageCompleted(self, stage_completed):
+        info = stage_completed.stageInfo()
+        task_metrics = info.taskMetrics()
+        submitted = _option(info.submissionTime())
+        completed = _option(info.completionTime())
+        key = (info.stageId(), info.attemptNumber())
+        stage = {
+            "stage_id": info.stageId(),
+            "stage_attempt": info.attemptNumber(),
+            "name": info.name(),
+            "status": "FAILED" if info.failureReason().isDefined() else "COMPLETE",
+            "num_tasks": info.numTasks(),
+            "duration_ms": completed - submitted if submitted and completed else None,
+        }
+        if task_metrics is not None:
+            stage.update(
+                {
+                    "executor_run_time_ms": task_metrics.executorRunTime(),
+                    "executor_cpu_time_ms": task_metrics.executorCpuTime() // 1000000,
+                    "jvm_gc_time_ms": task_metrics.jvmGCTime(),
+                    "input_bytes": task_metrics.inputMetrics().bytesRead(),
+                    "shuffle_read_bytes": task_metrics.shuffleReadMetrics().totalBytesRead(),
+                    "shuffle_write_bytes": task_metrics.shuffleWriteMetrics().bytesWritten(),
+                    "memory_bytes_spilled": task_metrics.memoryBytesSpilled(),
+                    "disk_bytes_spilled": task_metrics.diskBytesSpilled(),
+                }
+            )
+        with self._lock:
+            self.stages[key] = stage
+
+    def metric_rows(self, batch_id, application):
+        """
+        One row per finished stage and one per job, the job rows summing their stages
+        """
+        with self._lock:
+            stages = dict(self.stages)
+            jobs = dict(self.jobs)
+            task_run_times = dict(self.task_run_times)
+            stage_job = dict(self.stage_job)
+
+        rows = []
+        job_totals = {}
+        for key, stage in sorted(stages.items()):
+            count, total, longest = task_run_times.get(key, (0, 0, 0))
+            mean = total / count if count else None
+            job_id = stage_job.get(stage["stage_id"])
+            row = dict(
+                stage,
+                batch_id=batch_id,
+                application=application,
+                level="stage",
+                job_id=job_id,
+                max_task_run_time_ms=longest if count else None,
+                mean_task_run_time_ms=mean,
+                task_skew=longest / mean if mean else None,
+            )
+            rows.append(row)
+
+            totals = job_totals.setdefault(job_id, {"num_tasks": 0, "max_task_run_time_ms": 0})
+            totals["num_tasks"] += stage["num_tasks"]
+            totals["max_task_run_time_ms"] = max(totals["max_task_run_time_ms"], longest)
+            for metric in STAGE_TOTALS:
+                totals[metric] = totals.get(metric, 0) + (stage.get(metric) or 0)
+
+        for job_id, job in sorted(jobs.items()):
+            start, end = job.get("start_time"), job.get("end_time")
+            rows.append(
+                dict(
+                    job_totals.get(job_id, {}),
+                    batch_id=batch_id,
+                    application=application,
+                    level="job",
+                    job_id=job_id,
+                    name=job.get("name"),
+                    status=job.get("status"),
+                    duration_ms=end - start if start and end else None,
+                )
+            )
+
+        return [tuple(row.get(field.name) for field in METRICS_SCHEMA.fields) for row in rows]
+
+
+def register_metrics_listener(spark):
+    sc = spark.sparkContext
+    ensure_callback_server_started(sc._gateway)
+    listener = StageMetricsListener()
+    sc._jsc.sc().addSparkListener(listener)
+    return listener
+
+
+def write_metrics(spark, listener, batch_id, application, path):
+    """
+    Stop listening and append the collected metrics to the metrics table at path, partitioned by batch_id
+    """
+    spark.sparkContext._jsc.sc().removeSparkListener(listener)
+    rows = listener.metric_rows(batch_id, application)
+    spark.createDataFrame(rows, schema=METRICS_SCHEMA).coalesce(1).write.mode(
+        "append"
+    ).partitionBy("batch_id").parquet(path)
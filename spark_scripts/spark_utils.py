@@ -0,0 +1,21 @@
+"""
+Helpers shared by the PySpark jobs.
+"""
+import contextlib
+
+from pyspark import StorageLevel
+
+
+@contextlib.contextmanager
+def persisted(*dfs, storage_level=StorageLevel.MEMORY_AND_DISK):
+    """
+    Persist dataframes reused by several branches or actions for the duration of the block,
+    so each is computed once, then release them
+    """
+    for df in dfs:
+        df.persist(storage_level)
+    try:
+        yield dfs
+    finally:
+        for df in dfs:
+            df.unpersist()
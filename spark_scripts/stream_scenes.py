@@ -0,0 +1,286 @@
+"""
+Structured Streaming variant of synchronize_and_detect.py.
+
+Watches the bag_parquets output of the extraction tasks as a file source and synchronizes and
+detects scenes of every bag as soon as its files have landed, appending to the same tables as the
+batch job, instead of waiting for the trigger to collect a batch and launch a cluster.
+
+Only file paths stream through Spark: the binaryFile source lists new files without reading their
+content, and every micro-batch records them per bag_file on the driver. A bag is processed once
+every expected topic has a file, or once the watermark, the newest file modification time seen less
+--idle-timeout-secs, has passed the bag's last file, so a bag missing a topic is not held back
+forever. The file source's checkpoint counts the files of pending bags as read, so pending bags are
+saved to <checkpoint-location>/pending_bags after every micro-batch and reloaded on restart, and
+processed bags to <checkpoint-location>/processed_bags. Files landing for a bag already processed,
+e.g. a topic missing when its idle timeout passed, are dropped instead of processing it again.
+Bags without any topic the scene detectors read are not processed.
+
+Runs on local-mode Spark against local directories, e.g.
+
+    python stream_scenes.py --bag-parquets-uri file:///tmp/dest/bag_parquets \\
+        --synchronized-bucket file:///tmp/sync --scenes-bucket file:///tmp/scenes \\
+        --checkpoint-location file:///tmp/stream-checkpoint --once
+"""
+from pyspark.sql import SparkSession, types
+from pyspark.sql.utils import AnalysisException
+import pyspark.sql.functions as func
+
+import argparse
+import sys
+
+import synchronize_and_detect
+from scene_detectors import required_topic_columns
+
+PENDING_SCHEMA = types.StructType(
+    [
+        types.StructField("bag_file", types.StringType()),
+        types.StructField("topic", types.StringType()),
+        types.StructField("path", types.StringType()),
+        types.StructField("modification_time_ms", types.LongType()),
+    ]
+)
+
+PROCESSED_SCHEMA = types.StructType([types.StructField("bag_file", types.StringType())])
+
+# Fixed schema of the binaryFile source, streaming sources do not infer it
+BINARY_FILE_SCHEMA = types.StructType(
+    [
+        types.StructField("path", types.StringType(), False),
+        types.StructField("modificationTime", types.TimestampType(), False),
+        types.StructField("length", types.LongType(), False),
+        types.StructField("content", types.BinaryType(), True),
+    ]
+)
+
+# <bag_parquets>/<topic>/bag_file=<bag_file>/<file>
+FILE_PATH_PATTERN = r"/([^/]+)/bag_file=([^/]+)/[^/]+$"
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bag-parquets-uri", required=True)
+    parser.add_argument("--synchronized-bucket", required=True)
+    parser.add_argument("--scenes-bucket", required=True)
+    parser.add_argument("--checkpoint-location", required=True)
+    parser.add_argument("--output-dynamo-table")
+    parser.add_argument(
+        "--expected-topics",
+        default="",
+        help="Comma separated topics a bag needs before it is processed, defaults to the detector inputs",
+    )
+    parser.add_argument("--idle-timeout-secs", type=int, default=300)
+    parser.add_argument("--trigger-secs", type=int, default=30)
+    parser.add_argument("--max-files-per-trigger", type=int, default=1000)
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Process the files already landed, then every bag still pending, and stop",
+    )
+    return parser.parse_args(args=args)
+
+
+class PendingBags:
+    """
+    Files seen per bag_file and topic for bags not processed yet, with the watermark over file
+    modification times, and the bag_files already processed
+    """
+
+    def __init__(self, expected_topics, idle_timeout_ms):
+        self.expected_topics = set(expected_topics)
+        self.idle_timeout_ms = idle_timeout_ms
+        self.files = {}
+        self.last_modified_ms = {}
+        self.max_modified_ms = 0
+        self.processed = set()
+
+    def add(self, rows):
+        for bag_file, topic, path, modification_time_ms in rows:
+            if bag_file in self.processed:
+                print(f"Dropping {path}: {bag_file} is already processed")
+                continue
+            self.files.setdefault(bag_file, {}).setdefault(topic, set()).add(path)
+            self.last_modified_ms[bag_file] = max(
+                self.last_modified_ms.get(bag_file, 0), modification_time_ms
+            )
+            self.max_modified_ms = max(self.max_modified_ms, modification_time_ms)
+
+    def pop_ready(self, flush=False):
+        """
+        Batch metadata items, as synchronize_topics expects them, of the complete or idle bags
+        """
+        watermark_ms = self.max_modified_ms - self.idle_timeout_ms
+        ready = [
+            bag_file
+            for bag_file, topics in self.files.items()
+            if flush
+            or self.expected_topics.issubset(topics)
+            or self.last_modified_ms[bag_file] < watermark_ms
+        ]
+        items = []
+        for bag_file in ready:
+            topics = self.files.pop(bag_file)
+            self.last_modified_ms.pop(bag_file)
+            items.append(
+                {
+                    "Name": bag_file,
+                    "topics": sorted(topics),
+                    "files": sorted(p for paths in topics.values() for p in paths),
+                }
+            )
+        return items
+
+    def mark_processed(self, bag_files):
+        self.processed.update(bag_files)
+
+    def rows(self):
+        return [
+            (bag_file, topic, path, self.last_modified_ms[bag_file])
+            for bag_file, topics in self.files.items()
+            for topic, paths in topics.items()
+            for path in paths
+        ]
+
+
+def read_state(spark, checkpoint_location, name, schema):
+    try:
+        return spark.read.schema(schema).parquet(f"{checkpoint_location}/{name}").collect()
+    except AnalysisException:
+        # First start, nothing saved yet
+        return []
+
+
+def load_pending(spark, checkpoint_location, pending):
+    processed = read_state(spark, checkpoint_location, "processed_bags", PROCESSED_SCHEMA)
+    pending.mark_processed(r.bag_file for r in processed)
+    rows = read_state(spark, checkpoint_location, "pending_bags", PENDING_SCHEMA)
+    pending.add([tuple(r) for r in rows])
+
+
+def save_pending(spark, checkpoint_location, pending):
+    spark.createDataFrame(
+        [(bag_file,) for bag_file in sorted(pending.processed)], schema=PROCESSED_SCHEMA
+    ).coalesce(1).write.mode("overwrite").parquet(f"{checkpoint_location}/processed_bags")
+    spark.createDataFrame(pending.rows(), schema=PENDING_SCHEMA).coalesce(1).write.mode(
+        "overwrite"
+    ).parquet(f"{checkpoint_location}/pending_bags")
+
+
+def new_files(spark, bag_parquets_uri, max_files_per_trigger):
+    """
+    Stream of the files landing under bag_parquets, one row per file with its bag_file and topic
+    """
+    files = (
+        spark.readStream.format("binaryFile")
+        .schema(BINARY_FILE_SCHEMA)
+        .option("maxFilesPerTrigger", max_files_per_trigger)
+        .load(f"{bag_parquets_uri}/*/bag_file=*/")
+    )
+    return (
+        files.select(
+            func.regexp_extract("path", FILE_PATH_PATTERN, 2).alias("bag_file"),
+            func.regexp_extract("path", FILE_PATH_PATTERN, 1).alias("topic"),
+            "path",
+            (func.col("modificationTime").cast("double") * 1000).cast("long").alias(
+                "modification_time_ms"
+            ),
+        )
+        # grid aligned copies are only read by synchronize_topics.py --grid-mode
+        .filter((func.col("bag_file") != "") & ~func.col("topic").endswith("_grid"))
+    )
+
+
+def process_bags(spark, items, batch_id, synchronized_bucket, scenes_bucket, output_dynamo_table):
+    """
+    Synchronize and detect scenes of the bags, returning the bag_files processed
+
+    Bags with none of the topics the scene detectors read have nothing to synchronize, they are left out
+    """
+    detector_topics = set(required_topic_columns())
+    skipped = [item["Name"] for item in items if not detector_topics.intersection(item["topics"])]
+    if skipped:
+        print(f"Batch {batch_id}: skipping {', '.join(skipped)}, no scene detector topics")
+    items = [item for item in items if item["Name"] not in skipped]
+    if not items:
+        return []
+    print(f"Batch {batch_id}: processing {', '.join(item['Name'] for item in items)}")
+    synchronize_and_detect.main(
+        None,
+        batch_id,
+        synchronized_bucket,
+        scenes_bucket,
+        output_dynamo_table,
+        spark,
+        batch_metadata=items,
+    )
+    return [item["Name"] for item in items]
+
+
+def main(
+    spark,
+    bag_parquets_uri,
+    synchronized_bucket,
+    scenes_bucket,
+    checkpoint_location,
+    output_dynamo_table=None,
+    expected_topics=None,
+    idle_timeout_secs=300,
+    trigger_secs=30,
+    max_files_per_trigger=1000,
+    once=False,
+):
+    pending = PendingBags(
+        expected_topics or list(required_topic_columns()), idle_timeout_ms=idle_timeout_secs * 1000
+    )
+    load_pending(spark, checkpoint_location, pending)
+
+    def process_micro_batch(files_df, epoch_id):
+        pending.add([tuple(r) for r in files_df.collect()])
+        processed = process_bags(
+            spark,
+            pending.pop_ready(),
+            f"stream-{epoch_id}",
+            synchronized_bucket,
+            scenes_bucket,
+            output_dynamo_table,
+        )
+        pending.mark_processed(processed)
+        save_pending(spark, checkpoint_location, pending)
+
+    writer = new_files(spark, bag_parquets_uri, max_files_per_trigger).writeStream.foreachBatch(
+        process_micro_batch
+    ).option("checkpointLocation", f"{checkpoint_location}/files")
+    writer = writer.trigger(once=True) if once else writer.trigger(processingTime=f"{trigger_secs} seconds")
+    query = writer.start()
+    query.awaitTermination()
+
+    if once:
+        processed = process_bags(
+            spark,
+            pending.pop_ready(flush=True),
+            "stream-flush",
+            synchronized_bucket,
+            scenes_bucket,
+            output_dynamo_table,
+        )
+        pending.mark_processed(processed)
+        save_pending(spark, checkpoint_location, pending)
+
+
+if __name__ == "__main__":
+    spark = SparkSession.builder.appName("stream-scenes").getOrCreate()
+    arguments = parse_arguments(sys.argv[1:])
+
+    main(
+        spark,
+        arguments.bag_parquets_uri,
+        arguments.synchronized_bucket,
+        arguments.scenes_bucket,
+        arguments.checkpoint_location,
+        output_dynamo_table=arguments.output_dynamo_table,
+        expected_topics=[t for t in arguments.expected_topics.split(",") if t],
+        idle_timeout_secs=arguments.idle_timeout_secs,
+        trigger_secs=arguments.trigger_secs,
+        max_files_per_trigger=arguments.max_files_per_trigger,
+        once=arguments.once,
+    )
+    spark.stop()
@@ -0,0 +1,120 @@
+"""
+Runs synchronize_topics.py and detect_scenes.py as one Spark application.
+
+The synchronized topics are persisted and handed to scene detection in memory instead of being
+read back from S3; synchronized_topics is still written to S3 as a side output for Athena and
+later reprocessing. Both steps take the same options as the separate jobs.
+"""
+from pyspark.sql import SparkSession
+
+import argparse
+import sys
+
+import detect_scenes
+import synchronize_topics
+from common import get_batch_file_metadata, table_path
+from spark_metrics import register_metrics_listener, write_metrics
+
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser(
+        parents=[synchronize_topics.synchronize_arguments(), detect_scenes.detection_arguments()]
+    )
+    parser.add_argument("--batch-metadata-table-name", required=True)
+    parser.add_argument("--batch-id", required=True)
+    parser.add_argument("--synchronized-bucket", required=True)
+    parser.add_argument("--scenes-bucket", required=True)
+    parser.add_argument("--output-dynamo-table", required=True)
+    parser.add_argument(
+        "--metrics-bucket",
+        help="Bucket for the spark_job_metrics table, defaults to the scenes bucket",
+    )
+    return parser.parse_args(args=args)
+
+
+def main(
+    batch_metadata_table_name,
+    batch_id,
+    synchronized_bucket,
+    scenes_bucket,
+    output_dynamo_table,
+    spark,
+    synchronized_format="dense",
+    min_duration_ns=0,
+    merge_gap_ns=0,
+    dynamo_endpoint_url=None,
+    batch_metadata=None,
+    **synchronize_kwargs,
+):
+    # Load files to process
+    if batch_metadata is None:
+        batch_metadata = get_batch_file_metadata(
+            table_name=batch_metadata_table_name, batch_id=batch_id
+        )
+
+    # The synchronized grid stays persisted after its tables are written, and scene detection
+    # reads it from memory
+    synchronized_df = synchronize_topics.synchronize(
+        spark,
+        batch_metadata,
+        synchronized_bucket,
+        synchronized_format=synchronized_format,
+        keep_persisted=True,
+        **synchronize_kwargs,
+    )
+    try:
+        detect_scenes.process_synchronized_data(
+            synchronized_df,
+            scenes_bucket,
+            output_dynamo_table,
+            min_duration_ns=min_duration_ns,
+            merge_gap_ns=merge_gap_ns,
+            dynamo_endpoint_url=dynamo_endpoint_url,
+        )
+    finally:
+        synchronized_df.unpersist()
+
+    if synchronized_format in ("dense", "both"):
+        # Record the detections against the synchronized_topics files just written, so a later
+        # detect_scenes.py run over the same bags skips them
+        fingerprints = detect_scenes.input_fingerprints(
+            spark,
+            synchronized_bucket,
+            "synchronized_topics",
+            [item["Name"] for item in batch_metadata],
+        )
+        detect_scenes.write_cache(
+            spark, scenes_bucket, detect_scenes.cache_entries(batch_metadata, fingerprints)
+        )
+
+
+if __name__ == "__main__":
+    spark = SparkSession.builder.appName("synchronize-and-detect").getOrCreate()
+    sc = spark.sparkContext
+    metrics_listener = register_metrics_listener(spark)
+
+    arguments = parse_arguments(sys.argv[1:])
+    batch_id = arguments.batch_id
+
+    try:
+        main(
+            arguments.batch_metadata_table_name,
+            batch_id,
+            arguments.synchronized_bucket,
+            arguments.scenes_bucket,
+            arguments.output_dynamo_table,
+            spark,
+            **synchronize_topics.synchronize_options(arguments),
+            **detect_scenes.detection_options(arguments),
+        )
+    finally:
+        write_metrics(
+            spark,
+            metrics_listener,
+            batch_id=batch_id,
+            application="synchronize-and-detect",
+            path=table_path(
+                arguments.metrics_bucket or arguments.scenes_bucket, "spark_job_metrics"
+            ),
+        )
+    sc.stop()
@@ -1,9 +1,23 @@
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession, Row, Window, types
-import boto3
 import argparse
 import sys
 import functools
 import pyspark.sql.functions as func
+from common import (
+    KEY_COLS,
+    NANOS_PER_SEC,
+    TIME_INTERVAL_NS,
+    get_batch_file_metadata,
+    table_path,
+)
+from scene_detectors import required_topic_columns
+from spark_metrics import register_metrics_listener, write_metrics
+from spark_utils import persisted
+from topic_changes import topic_changes
+
+
+TIME_BUCKET_NS = 60 * NANOS_PER_SEC
 
 
 def union_all(dfs):
@@ -18,43 +32,131 @@ def union_all(dfs):
     return functools.reduce(lambda df1, df2: df1.union(df2.select(df1.columns)), dfs)
 
 
+def synchronize_arguments():
+    """
+    Synchronization options shared by synchronize_topics.py and synchronize_and_detect.py
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--all-columns",
+        action="store_true",
+        help="Synchronize every column of every topic instead of the columns scene detectors declare",
+    )
+    parser.add_argument(
+        "--time-bucket-secs",
+        type=int,
+        default=60,
+        help="Length of the time buckets long bags are split into for parallel forward filling",
+    )
+    parser.add_argument("--max-records-per-file", type=int, default=500000)
+    parser.add_argument("--row-group-size-mb", type=int, default=32)
+    parser.add_argument(
+        "--rollup-resolutions",
+        default="",
+        help="Comma separated resolutions in whole seconds to write synchronized_topics_{n}s rollups for",
+    )
+    parser.add_argument(
+        "--rollup-aggregates",
+        default="",
+        help="Comma separated topic:field numeric fields to aggregate (min, max, avg) in the rollups",
+    )
+    parser.add_argument(
+        "--grid-mode",
+        action="store_true",
+        help="Join the grid aligned <topic>_grid files written by extraction instead of forward filling",
+    )
+    parser.add_argument(
+        "--synchronized-format",
+        choices=["dense", "changes", "both"],
+        default="dense",
+        help="Write the forward filled grid (synchronized_topics), only the value changes "
+        "of each topic (synchronized_topic_changes), or both",
+    )
+    return parser
+
+
+def synchronize_options(arguments):
+    """
+    Keyword arguments of synchronize() from options parsed with synchronize_arguments()
+    """
+    return dict(
+        all_columns=arguments.all_columns,
+        time_bucket_ns=arguments.time_bucket_secs * NANOS_PER_SEC,
+        max_records_per_file=arguments.max_records_per_file,
+        row_group_size_mb=arguments.row_group_size_mb,
+        synchronized_format=arguments.synchronized_format,
+        grid_mode=arguments.grid_mode,
+        rollup_resolutions=[int(r) for r in arguments.rollup_resolutions.split(",") if r],
+        rollup_aggregates=parse_rollup_aggregates(
+            [a for a in arguments.rollup_aggregates.split(",") if a]
+        ),
+    )
+
+
 def parse_arguments(args):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(parents=[synchronize_arguments()])
     parser.add_argument("--batch-metadata-table-name", required=True)
     parser.add_argument("--batch-id", required=True)
     parser.add_argument("--output-bucket", required=True)
+    parser.add_argument(
+        "--metrics-bucket",
+        help="Bucket for the spark_job_metrics table, defaults to the output bucket",
+    )
     return parser.parse_args(args=args)
 
 
-def get_batch_file_metadata(table_name, batch_id):
-    dynamodb = boto3.resource("dynamodb", region_name="eu-west-1")
-    table = dynamodb.Table(table_name)
-    response = table.query(
-        KeyConditions={
-            "BatchId": {"AttributeValueList": [batch_id], "ComparisonOperator": "EQ"}
-        }
+def with_time_ns(df):
+    """
+    Add the integer nanosecond Time_ns key for parquets extracted before it was written at extraction
+    """
+    if "Time_ns" in df.columns:
+        return df
+    return df.withColumn(
+        "Time_ns", func.round(func.col("Time") * NANOS_PER_SEC).cast(types.LongType())
     )
-    data = response["Items"]
-    while "LastEvaluatedKey" in response:
-        response = table.query(ExclusiveStartKey=response["LastEvaluatedKey"])
-        data.update(response["Items"])
-    return data
 
 
-def load_file_path(spark, file_path, topic, bag_file):
+def selected_topic_columns(all_columns=False, rollup_aggregates={}):
+    """
+    Columns to synchronize per topic, None for every column of every topic
+
+    Without all_columns, the columns scene detectors declare and the fields rollups aggregate
+    """
+    if all_columns:
+        return None
+    col_selection_dict = required_topic_columns()
+    for topic, fields in rollup_aggregates.items():
+        topic_cols = col_selection_dict.setdefault(topic, [])
+        topic_cols.extend(f for f in fields if f not in topic_cols)
+    return col_selection_dict
+
+
+def load_file_path(spark, file_path, topic, bag_file, columns=None):
+    df = spark.read.load(file_path)
+    if columns is not None:
+        # Selecting before any other transformation lets parquet skip the unused column chunks
+        df = df.select(*[c for c in df.columns if c in KEY_COLS or c in columns])
     df = (
-        spark.read.load(file_path)
+        with_time_ns(df)
         .withColumn("topic", func.lit(topic))
         .withColumn("bag_file", func.lit(bag_file))
     )
     return df
 
 
-def load_and_union_data(spark, batch_metadata):
+def load_and_union_data(spark, batch_metadata, col_selection_dict=None, grid=False):
+    """
+    Load each topic's files for the batch, keeping only the topics and columns in
+    col_selection_dict when it is given
+
+    With grid, load the grid aligned <topic>_grid files extraction lists under grid_files instead
+    """
     distinct_topics = set()
     for item in batch_metadata:
         for t in item["topics"]:
             distinct_topics.add(t)
+    if col_selection_dict is not None:
+        distinct_topics = distinct_topics.intersection(col_selection_dict)
 
     topic_dfs = {}
 
@@ -62,32 +164,181 @@ def load_and_union_data(spark, batch_metadata):
         dfs = []
         for bag_file in batch_metadata:
             print(f"{bag_file['Name']}_{topic}")
+            if grid:
+                files = [f for f in bag_file.get("grid_files", []) if f"/{topic}_grid/" in f]
+            else:
+                files = [f for f in bag_file["files"] if topic in f]
             bag_dfs = [
                 load_file_path(
-                    spark, file_path=file, topic=topic, bag_file=bag_file["Name"]
+                    spark,
+                    file_path=file,
+                    topic=topic,
+                    bag_file=bag_file["Name"],
+                    columns=None
+                    if col_selection_dict is None
+                    else col_selection_dict[topic] + (["message_Time_ns"] if grid else []),
                 )
-                for file in bag_file["files"]
-                if topic in file
+                for file in files
             ]
             dfs.extend(bag_dfs)
-        topic_dfs[topic] = union_all(dfs)
+        if dfs:
+            topic_dfs[topic] = union_all(dfs)
 
     return topic_dfs
 
 
-def join_topics(dfs, col_selection_dict):
-    filtered_dfs = []
-    # Take first row per topic per bag_file per second rounded
-    for topic_name, topic_df in dfs.items():
-        topic_col_subset = col_selection_dict[topic_name]
-        if "bag_file" not in topic_col_subset:
-            topic_col_subset.append("bag_file")
-        filtered_dfs.append(topic_df.select(*topic_col_subset))
+def write_results(
+    df,
+    table_name,
+    output_bucket,
+    partition_cols=[],
+    sort_cols=[],
+    bucket_col=None,
+    time_bucket_ns=TIME_BUCKET_NS,
+    max_records_per_file=None,
+    row_group_size_mb=None,
+):
+    """
+    Write df to s3 as parquet, clustered by partition_cols and sort_cols.
+
+    Rows are hash partitioned on partition_cols and the time_bucket_ns bucket of bucket_col, then
+    sorted by sort_cols within each partition, so each output file, and each row group inside it,
+    holds a narrow contiguous range of sort_cols and the min/max statistics parquet writes per row
+    group let Athena and Spark skip row groups outside a queried time window. Like the fill
+    windows, a long bag is written by one task per time bucket, and unlike a range partitioning
+    this needs no sampling job, which would compute an unpersisted df twice.
+    """
+    s3_path = table_path(output_bucket, table_name)
+    if sort_cols:
+        if bucket_col is not None:
+            df = df.repartition(
+                *partition_cols, func.expr(f"{bucket_col} div {time_bucket_ns}")
+            )
+        elif partition_cols:
+            df = df.repartition(*partition_cols)
+        df = df.sortWithinPartitions(*partition_cols, *sort_cols)
+
+    writer = df.write.mode("append").partitionBy(*partition_cols)
+    if max_records_per_file:
+        writer = writer.option("maxRecordsPerFile", max_records_per_file)
+    if row_group_size_mb:
+        writer = writer.option("parquet.block.size", row_group_size_mb * 1024 * 1024)
+    writer.parquet(s3_path)
+
+
+def write_topic_changes(
+    changes,
+    output_bucket,
+    time_bucket_ns=TIME_BUCKET_NS,
+    max_records_per_file=None,
+    row_group_size_mb=None,
+):
+    """
+    Save the run-length synchronized topics, sorted by topic so a scan of one topic skips the
+    row groups of the others
+    """
+    write_results(
+        changes,
+        table_name="synchronized_topic_changes",
+        output_bucket=output_bucket,
+        partition_cols=["bag_file"],
+        sort_cols=["topic", "valid_from_ns"],
+        bucket_col="valid_from_ns",
+        time_bucket_ns=time_bucket_ns,
+        max_records_per_file=max_records_per_file,
+        row_group_size_mb=row_group_size_mb,
+    )
+
+
+def parse_rollup_aggregates(specs):
+    """
+    Parse "topic:field" specs into {topic: [field, ...]}
+    """
+    aggregates = {}
+    for spec in specs:
+        topic, field = spec.split(":", 1)
+        aggregates.setdefault(topic, []).append(field)
+    return aggregates
+
+
+def rollup_synchronized_topics(synchronized_df, topics, resolution_secs, aggregates={}):
+    """
+    Downsample the synchronized grid to resolution_secs buckets, labelled by their start time
+
+    Every topic keeps its last value in the bucket as {topic}_clean. Numeric fields listed in
+    aggregates additionally get {topic}_{field}_min, _max and _avg over the bucket's ticks.
+    """
+    resolution_ns = resolution_secs * NANOS_PER_SEC
+    columns = [
+        func.max(
+            func.when(
+                func.col(f"{t}_clean").isNotNull(),
+                func.struct(func.col("Time_ns"), func.col(f"{t}_clean").alias("value")),
+            )
+        )
+        .getField("value")
+        .alias(f"{t}_clean")
+        for t in topics
+    ]
+    for topic, fields in aggregates.items():
+        if topic not in topics:
+            continue
+        for field in fields:
+            value = func.get_json_object(f"{topic}_clean", f"$.{field}").cast(types.DoubleType())
+            columns.extend(
+                [
+                    func.min(value).alias(f"{topic}_{field}_min"),
+                    func.max(value).alias(f"{topic}_{field}_max"),
+                    func.avg(value).alias(f"{topic}_{field}_avg"),
+                ]
+            )
+
+    return (
+        synchronized_df.withColumn(
+            "bucket", func.expr(f"(Time_ns div {resolution_ns}) * {resolution_ns}")
+        )
+        .groupBy("bag_file", "bag_file_prefix", "bag_file_bucket", "bucket")
+        .agg(*columns)
+        .withColumnRenamed("bucket", "Time_ns")
+        .withColumn("Time", func.col("Time_ns") / NANOS_PER_SEC)
+    )
 
 
-def write_results(df, table_name, output_bucket, partition_cols=[]):
-    s3_path = f"s3://{output_bucket}/{table_name}"
-    df.write.mode("append").partitionBy(*partition_cols).parquet(s3_path)
+def write_rollups(
+    synchronized_df,
+    topics,
+    output_bucket,
+    rollup_resolutions,
+    rollup_aggregates={},
+    time_bucket_ns=TIME_BUCKET_NS,
+    max_records_per_file=None,
+    row_group_size_mb=None,
+):
+    """
+    Save a synchronized_topics_{n}s table per rollup resolution, partitioned like synchronized_topics
+    """
+    for resolution_secs in rollup_resolutions:
+        rollup = rollup_synchronized_topics(
+            synchronized_df, topics, resolution_secs, aggregates=rollup_aggregates
+        )
+        write_results(
+            rollup.select(
+                "bag_file",
+                "bag_file_prefix",
+                "bag_file_bucket",
+                "Time",
+                "Time_ns",
+                *[c for c in rollup.columns if c not in KEY_COLS + ["bag_file"]],
+            ),
+            table_name=f"synchronized_topics_{resolution_secs}s",
+            output_bucket=output_bucket,
+            partition_cols=["bag_file"],
+            sort_cols=["Time_ns"],
+            bucket_col="Time_ns",
+            time_bucket_ns=time_bucket_ns,
+            max_records_per_file=max_records_per_file,
+            row_group_size_mb=row_group_size_mb,
+        )
 
 
 def create_json_payload(df, non_json_cols):
@@ -102,51 +353,36 @@ def transform_and_union_dfs(dfs):
     transformed_dfs = []
     for k, v in dfs.items():
         transformed_df = create_json_payload(
-            v, non_json_cols=["Time", "bag_file_prefix", "bag_file_bucket", "bag_file"]
+            v,
+            non_json_cols=[
+                "Time",
+                "Time_ns",
+                "bag_file_prefix",
+                "bag_file_bucket",
+                "bag_file",
+            ],
         ).withColumn("topic", func.lit(k))
         transformed_dfs.append(transformed_df)
     return union_all(transformed_dfs)
 
 
-def create_master_time_df(signals_df, topics):
+def create_master_time_df(signals_df, topics, time_interval_ns=TIME_INTERVAL_NS):
     """
     Explode possible timestamps for each bag file's time range
-    """
-    time_interval_secs = 0.1
-
-    w = Window.partitionBy("bag_file", "bag_file_prefix","bag_file_bucket").orderBy(func.asc("Time"))
-
-    first_and_last_signals = (
-        signals_df.withColumn("rn", func.row_number().over(w))
-        .withColumn("max_rn", func.max("rn").over(Window.partitionBy("bag_file", "bag_file_prefix","bag_file_bucket")))
-        .where((func.col("rn") == func.col("max_rn")) | (func.col("rn") == 1))
-        .select("bag_file", "bag_file_prefix","bag_file_bucket", "Time", "rn")
-        .groupBy("bag_file", "bag_file_prefix","bag_file_bucket")
-        .agg(func.collect_list("Time").alias("Times"))
-        .collect()
-    )
 
-    def customFunction(row):
-
-        df = spark.range(
-            row.Times[0] / time_interval_secs, row.Times[1] / time_interval_secs
-        ).select(func.col("id"))
-
-        return (
-            df.withColumn("Time", func.expr(f"id * {time_interval_secs}"))
-            .withColumn("bag_file", func.lit(row.bag_file))
-            .withColumn("bag_file_prefix", func.lit(row.bag_file_prefix))
-            .withColumn("bag_file_bucket", func.lit(row.bag_file_bucket))
-            .drop("id")
+    Grid ticks are integer multiples of time_interval_ns, so every tick lands on an exact Time_ns value
+    """
+    master_time_df = (
+        signals_df.groupBy("bag_file", "bag_file_prefix", "bag_file_bucket")
+        .agg(
+            func.expr(f"min(Time_ns) div {time_interval_ns}").alias("first_tick"),
+            func.expr(f"max(Time_ns) div {time_interval_ns}").alias("last_tick"),
         )
-
-    dfs = []
-    for bag_file in first_and_last_signals:
-        print(bag_file)
-        dfs.append(customFunction(bag_file))
-
-    master_time_df = union_all(dfs).withColumn(
-        "source", func.lit("master_time_df").cast(types.StringType())
+        .where(func.col("last_tick") > func.col("first_tick"))
+        .withColumn("tick", func.explode(func.expr("sequence(first_tick, last_tick - 1)")))
+        .withColumn("Time_ns", func.col("tick") * time_interval_ns)
+        .select("bag_file", "bag_file_prefix", "bag_file_bucket", "Time_ns")
+        .withColumn("source", func.lit("master_time_df").cast(types.StringType()))
     )
 
     for t in topics:
@@ -159,7 +395,9 @@ def create_master_time_df(signals_df, topics):
 
 def fill_with_last_value(df, col):
     # define the window
-    w = Window.partitionBy("bag_file", "bag_file_prefix","bag_file_bucket").orderBy(func.asc("Time"))
+    w = Window.partitionBy(
+        "bag_file", "bag_file_prefix", "bag_file_bucket", "time_bucket"
+    ).orderBy(func.asc("Time_ns"))
 
     last_value_column = func.last(df[col], ignorenulls=True).over(w)
 
@@ -167,70 +405,293 @@ def fill_with_last_value(df, col):
     return df
 
 
-def synchronize_signals(signals_df, topics):
-    master_time_df = create_master_time_df(signals_df, topics)
+def carry_over_last_values(topic_signals, topics, time_bucket_ns):
+    """
+    Value of each topic carried into every time bucket of a bag from the buckets before it
+
+    One row per bag and bucket, so this stays small even for long bags
+    """
+    bag_buckets = (
+        topic_signals.groupBy("bag_file", "bag_file_prefix", "bag_file_bucket")
+        .agg(
+            func.expr(f"min(Time_ns) div {time_bucket_ns}").alias("first_bucket"),
+            func.expr(f"max(Time_ns) div {time_bucket_ns}").alias("last_bucket"),
+        )
+        .withColumn(
+            "time_bucket",
+            func.explode(func.expr("sequence(first_bucket, last_bucket)")),
+        )
+        .select("bag_file", "bag_file_prefix", "bag_file_bucket", "time_bucket")
+    )
+
+    # Last non-null value per topic within each bucket, taken from the (Time_ns, value) struct with the greatest Time_ns
+    last_in_bucket = (
+        topic_signals.withColumn("time_bucket", func.expr(f"Time_ns div {time_bucket_ns}"))
+        .groupBy("bag_file", "bag_file_prefix", "bag_file_bucket", "time_bucket")
+        .agg(
+            *[
+                func.max(
+                    func.when(
+                        func.col(t).isNotNull(),
+                        func.struct(func.col("Time_ns"), func.col(t).alias("value")),
+                    )
+                )
+                .getField("value")
+                .alias(t)
+                for t in topics
+            ]
+        )
+    )
+
+    w = (
+        Window.partitionBy("bag_file", "bag_file_prefix", "bag_file_bucket")
+        .orderBy(func.asc("time_bucket"))
+        .rowsBetween(Window.unboundedPreceding, -1)
+    )
+
+    carried = bag_buckets.join(
+        last_in_bucket,
+        on=["bag_file", "bag_file_prefix", "bag_file_bucket", "time_bucket"],
+        how="left",
+    )
+    return carried.select(
+        "bag_file",
+        "bag_file_prefix",
+        "bag_file_bucket",
+        "time_bucket",
+        *[func.last(carried[t], ignorenulls=True).over(w).alias(f"{t}_carry") for t in topics],
+    )
 
-    topic_signals = (
-        signals_df.select("bag_file", "bag_file_prefix","bag_file_bucket", "Time", "topic", "payload")
-        .groupby("bag_file", "bag_file_prefix", "bag_file_bucket", "Time")
-        .pivot("topic")
+
+def pivot_topic_signals(signals_df, topics):
+    return (
+        signals_df.select("bag_file", "bag_file_prefix","bag_file_bucket", "Time_ns", "topic", "payload")
+        .groupby("bag_file", "bag_file_prefix", "bag_file_bucket", "Time_ns")
+        .pivot("topic", topics)
         .agg(func.first("payload"))
         .withColumn("source", func.lit("signals_df").cast(types.StringType()))
     )
 
+
+def synchronize_signals(topic_signals, topics, time_bucket_ns=TIME_BUCKET_NS):
+    """
+    Forward fill every topic of the pivoted topic_signals onto the master time grid
+
+    Rows are range partitioned by (bag_file, time_bucket) so a long bag is filled by many tasks
+    instead of one; each bucket starts from the values carried over from the buckets before it.
+    topic_signals is read three times (grid extent, fill and carry-over), callers running this
+    more than once per action should persist it.
+    """
+    master_time_df = create_master_time_df(topic_signals, topics)
+
     unioned_signals = (
         master_time_df.select(*topic_signals.columns)
         .union(topic_signals)
-        .orderBy(func.asc("Time"))
+        .withColumn("time_bucket", func.expr(f"Time_ns div {time_bucket_ns}"))
+        .repartitionByRange("bag_file", "time_bucket")
     )
 
-    topic_cols_clean = ["bag_file", "bag_file_prefix","bag_file_bucket", "Time"]
-
     for topic in topics:
         unioned_signals = fill_with_last_value(unioned_signals, topic)
-        topic_cols_clean.append(f"{topic}_clean")
 
-    unioned_signals = unioned_signals.filter("source = 'master_time_df'").select(
-        *topic_cols_clean
+    carry_over = carry_over_last_values(topic_signals, topics, time_bucket_ns)
+
+    unioned_signals = (
+        unioned_signals.filter("source = 'master_time_df'")
+        .join(
+            func.broadcast(carry_over),
+            on=["bag_file", "bag_file_prefix", "bag_file_bucket", "time_bucket"],
+            how="left",
+        )
+        .select(
+            "bag_file",
+            "bag_file_prefix",
+            "bag_file_bucket",
+            (func.col("Time_ns") / NANOS_PER_SEC).alias("Time"),
+            "Time_ns",
+            *[
+                func.coalesce(func.col(f"{t}_clean"), func.col(f"{t}_carry")).alias(f"{t}_clean")
+                for t in topics
+            ],
+        )
     )
 
     return unioned_signals
 
 
-def synchronize_topics(topic_data):
-    signals_df = transform_and_union_dfs(topic_data)
-    synchronized_df = synchronize_signals(signals_df, topics=list(topic_data.keys()))
-
-    return synchronized_df
+def synchronize_grid_topics(topic_data, topics):
+    """
+    Synchronize topics extracted aligned to the time grid
 
+    Every row of a <topic>_grid file already holds the topic's last message at or before its tick,
+    so synchronization is a join of the topics on (bag_file, Time_ns), done as one pivot without
+    sorting or forward filling. Ticks before a topic's first message have no message_Time_ns and
+    stay null.
+    """
+    grid_signals = []
+    for topic, df in topic_data.items():
+        grid_signals.append(
+            create_json_payload(
+                df,
+                non_json_cols=KEY_COLS + ["bag_file", "topic", "message_Time_ns"],
+            )
+            .withColumn(
+                "payload",
+                func.when(func.col("message_Time_ns").isNotNull(), func.col("payload")),
+            )
+            .select("bag_file", "bag_file_prefix", "bag_file_bucket", "Time_ns", "topic", "payload")
+        )
 
-def main(batch_metadata_table_name, batch_id, output_bucket, spark):
-    # Load files to process
-    batch_metadata = get_batch_file_metadata(
-        table_name=batch_metadata_table_name, batch_id=batch_id
+    return (
+        union_all(grid_signals)
+        .groupby("bag_file", "bag_file_prefix", "bag_file_bucket", "Time_ns")
+        .pivot("topic", topics)
+        .agg(func.first("payload"))
+        .select(
+            "bag_file",
+            "bag_file_prefix",
+            "bag_file_bucket",
+            (func.col("Time_ns") / NANOS_PER_SEC).alias("Time"),
+            "Time_ns",
+            *[func.col(t).alias(f"{t}_clean") for t in topics],
+        )
     )
 
-    # Load topic data from s3 and union
-    topic_data = load_and_union_data(spark, batch_metadata)
-    synchronized_df = synchronize_topics(topic_data)
 
-    # Save Synchronized Signals to S3
-    write_results(
-        synchronized_df,
-        table_name="synchronized_topics",
-        output_bucket=output_bucket,
-        partition_cols=["bag_file"],
-    )
+def synchronize(
+    spark,
+    batch_metadata,
+    output_bucket,
+    all_columns=False,
+    time_bucket_ns=TIME_BUCKET_NS,
+    max_records_per_file=None,
+    row_group_size_mb=None,
+    synchronized_format="dense",
+    rollup_resolutions=[],
+    rollup_aggregates={},
+    grid_mode=False,
+    keep_persisted=False,
+):
+    """
+    Synchronize the topics of the batch's bags and write synchronized_topics, its rollups and
+    synchronized_topic_changes as selected, returning the synchronized grid
+
+    With keep_persisted the grid is returned persisted and materialized, for the caller to read
+    again and unpersist.
+    """
+    if grid_mode and synchronized_format != "dense":
+        raise ValueError("--grid-mode only writes the dense synchronized_topics table")
+    # Bags extracted before grid files were written, or too short for a single grid tick, have no
+    # grid_files and are forward filled from their topic files
+    grid_items = [item for item in batch_metadata if grid_mode and item.get("grid_files")]
+    raw_items = [item for item in batch_metadata if not (grid_mode and item.get("grid_files"))]
+
+    # Load topic data from s3 and union, pruned to the columns scene detectors and rollups read
+    col_selection_dict = selected_topic_columns(all_columns, rollup_aggregates)
+    grid_data = load_and_union_data(spark, grid_items, col_selection_dict, grid=True)
+    topic_data = load_and_union_data(spark, raw_items, col_selection_dict)
+    topics = list(dict.fromkeys([*grid_data, *topic_data]))
+    if not topics:
+        raise ValueError("No topic files to synchronize in the batch")
+
+    synchronized_dfs = []
+    topic_signals = None
+    if grid_data:
+        synchronized_dfs.append(synchronize_grid_topics(grid_data, topics))
+    if topic_data:
+        topic_signals = pivot_topic_signals(transform_and_union_dfs(topic_data), topics)
+        synchronized_dfs.append(
+            synchronize_signals(topic_signals, topics=topics, time_bucket_ns=time_bucket_ns)
+        )
+    synchronized_df = functools.reduce(lambda df1, df2: df1.unionByName(df2), synchronized_dfs)
+
+    if keep_persisted:
+        synchronized_df.persist(StorageLevel.MEMORY_AND_DISK)
+    # Rollups are aggregated from the synchronized grid, keep it when it is read more than once
+    num_reads = len(rollup_resolutions) + (synchronized_format in ("dense", "both"))
+    with persisted(*([synchronized_df] if num_reads > 1 and not keep_persisted else [])):
+        # The pivoted signals feed the time grid, the fill windows, the carry-over and the topic
+        # changes, persist them so the parquet scan, json encoding and pivot shuffle run once
+        with persisted(*([topic_signals] if topic_signals is not None else [])):
+            if synchronized_format in ("dense", "both"):
+                # Save Synchronized Signals to S3
+                write_results(
+                    synchronized_df,
+                    table_name="synchronized_topics",
+                    output_bucket=output_bucket,
+                    partition_cols=["bag_file"],
+                    sort_cols=["Time_ns"],
+                    bucket_col="Time_ns",
+                    time_bucket_ns=time_bucket_ns,
+                    max_records_per_file=max_records_per_file,
+                    row_group_size_mb=row_group_size_mb,
+                )
+            elif synchronized_df.is_cached:
+                # Fill the cached grid while the signals it is computed from are still persisted
+                synchronized_df.count()
+
+            if synchronized_format in ("changes", "both"):
+                write_topic_changes(
+                    topic_changes(topic_signals, topics),
+                    output_bucket=output_bucket,
+                    time_bucket_ns=time_bucket_ns,
+                    max_records_per_file=max_records_per_file,
+                    row_group_size_mb=row_group_size_mb,
+                )
+
+        write_rollups(
+            synchronized_df,
+            topics,
+            output_bucket=output_bucket,
+            rollup_resolutions=rollup_resolutions,
+            rollup_aggregates=rollup_aggregates,
+            time_bucket_ns=time_bucket_ns,
+            max_records_per_file=max_records_per_file,
+            row_group_size_mb=row_group_size_mb,
+        )
+    return synchronized_df
+
+
+def main(
+    batch_metadata_table_name,
+    batch_id,
+    output_bucket,
+    spark,
+    batch_metadata=None,
+    **synchronize_kwargs,
+):
+    # Load files to process
+    if batch_metadata is None:
+        batch_metadata = get_batch_file_metadata(
+            table_name=batch_metadata_table_name, batch_id=batch_id
+        )
+    synchronize(spark, batch_metadata, output_bucket, **synchronize_kwargs)
 
 
 if __name__ == "__main__":
     spark = SparkSession.builder.appName("synchronize-topics").getOrCreate()
     sc = spark.sparkContext
+    metrics_listener = register_metrics_listener(spark)
 
     arguments = parse_arguments(sys.argv[1:])
     batch_metadata_table_name = arguments.batch_metadata_table_name
     batch_id = arguments.batch_id
     output_bucket = arguments.output_bucket
 
-    main(batch_metadata_table_name, batch_id, output_bucket, spark)
+    try:
+        main(
+            batch_metadata_table_name,
+            batch_id,
+            output_bucket,
+            spark,
+            **synchronize_options(arguments),
+        )
+    finally:
+        write_metrics(
+            spark,
+            metrics_listener,
+            batch_id=batch_id,
+            application="synchronize-topics",
+            path=table_path(arguments.metrics_bucket or output_bucket, "spark_job_metrics"),
+        )
     sc.stop()
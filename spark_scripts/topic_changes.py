@@ -0,0 +1,128 @@
+"""
+Run-length (change only) representation of the synchronized topics.
+
+synchronized_topics repeats each topic's last value at every grid tick. synchronized_topic_changes
+keeps one row per topic value change instead, valid over [valid_from_ns, valid_to_ns), which is
+all a slowly updating topic needs. Every row also carries its bag's grid extent
+[grid_start_ns, grid_end_ns), so the dense grid can be rebuilt from any subset of topics.
+
+The readers below expand the changes back onto the grid, or join them by interval to any frame
+with bag_file and Time_ns, lazily like any other DataFrame.
+"""
+from pyspark.sql import Window, types
+import pyspark.sql.functions as func
+
+from common import BAG_COLS, NANOS_PER_SEC, TIME_INTERVAL_NS
+
+
+def topic_changes(topic_signals, topics, time_interval_ns=TIME_INTERVAL_NS):
+    """
+    Value changes of every topic in the pivoted topic_signals of synchronize_topics.py
+
+    A message repeating the topic's previous payload extends the previous row; the last change of
+    a topic stays valid until the end of the bag's grid
+    """
+    grid = topic_signals.groupBy(*BAG_COLS).agg(
+        func.expr(f"(min(Time_ns) div {time_interval_ns}) * {time_interval_ns}").alias(
+            "grid_start_ns"
+        ),
+        func.expr(f"(max(Time_ns) div {time_interval_ns}) * {time_interval_ns}").alias(
+            "grid_end_ns"
+        ),
+    )
+
+    stacked_topics = ", ".join(f"'{t}', `{t}`" for t in topics)
+    messages = topic_signals.select(
+        *BAG_COLS,
+        "Time_ns",
+        func.expr(f"stack({len(topics)}, {stacked_topics}) as (topic, payload)"),
+    ).filter("payload is not null")
+
+    w = Window.partitionBy(*BAG_COLS, "topic").orderBy("Time_ns")
+    changes = messages.withColumn("previous_payload", func.lag("payload").over(w)).filter(
+        "previous_payload is null or previous_payload != payload"
+    )
+
+    return (
+        changes.join(grid, on=BAG_COLS)
+        .withColumn(
+            "valid_to_ns",
+            func.coalesce(func.lead("Time_ns").over(w), func.col("grid_end_ns")),
+        )
+        .filter("Time_ns < grid_end_ns")
+        .select(
+            *BAG_COLS,
+            "topic",
+            func.col("Time_ns").alias("valid_from_ns"),
+            func.least("valid_to_ns", "grid_end_ns").alias("valid_to_ns"),
+            "payload",
+            "grid_start_ns",
+            "grid_end_ns",
+        )
+    )
+
+
+def expand_to_grid(changes, topics=None, time_interval_ns=TIME_INTERVAL_NS):
+    """
+    Dense synchronized_topics rows (bag columns, Time, Time_ns, {topic}_clean) rebuilt from changes
+
+    A change covers the ticks t with valid_from_ns <= t < valid_to_ns, the same value the forward
+    fill puts on those ticks
+    """
+    if topics is not None:
+        changes = changes.filter(func.col("topic").isin(topics))
+
+    grid = (
+        changes.groupBy(*BAG_COLS)
+        .agg(
+            func.expr(f"min(grid_start_ns) div {time_interval_ns}").alias("first_tick"),
+            func.expr(f"max(grid_end_ns) div {time_interval_ns}").alias("last_tick"),
+        )
+        .where(func.col("last_tick") > func.col("first_tick"))
+        .select(
+            *BAG_COLS,
+            func.explode(func.expr("sequence(first_tick, last_tick - 1)")).alias("tick"),
+        )
+    )
+
+    # first tick at or after valid_from_ns up to the last tick before valid_to_ns
+    values = (
+        changes.withColumn(
+            "first_tick",
+            func.expr(f"(valid_from_ns + {time_interval_ns - 1}) div {time_interval_ns}"),
+        )
+        .withColumn("last_tick", func.expr(f"(valid_to_ns - 1) div {time_interval_ns}"))
+        .where(func.col("last_tick") >= func.col("first_tick"))
+        .withColumn("tick", func.explode(func.expr("sequence(first_tick, last_tick)")))
+        .groupBy(*BAG_COLS, "tick")
+    )
+    values = values.pivot("topic", topics) if topics is not None else values.pivot("topic")
+    values = values.agg(func.first("payload"))
+    topic_cols = [c for c in values.columns if c not in BAG_COLS + ["tick"]]
+
+    return grid.join(values, on=BAG_COLS + ["tick"], how="left").select(
+        *BAG_COLS,
+        (func.col("tick") * time_interval_ns / NANOS_PER_SEC).alias("Time"),
+        (func.col("tick") * time_interval_ns).alias("Time_ns"),
+        *[func.col(f"`{t}`").alias(f"{t}_clean") for t in topic_cols],
+    )
+
+
+def join_by_interval(df, changes, topic):
+    """
+    Add {topic}_clean to df, the topic's value valid at each row's bag_file and Time_ns
+    """
+    values = changes.filter(func.col("topic") == topic).select(
+        func.col("bag_file").alias("change_bag_file"),
+        "valid_from_ns",
+        "valid_to_ns",
+        func.col("payload").cast(types.StringType()).alias(f"{topic}_clean"),
+    )
+    condition = (
+        (df["bag_file"] == values["change_bag_file"])
+        & (df["Time_ns"] >= values["valid_from_ns"])
+        & (df["Time_ns"] < values["valid_to_ns"])
+    )
+    return df.join(values, on=condition, how="left").drop(
+        "change_bag_file", "valid_from_ns", "valid_to_ns"
+    )
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPARK_SCRIPTS_DIR = os.path.join(ROOT_DIR, "spark_scripts")
+BENCHMARKS_DIR = os.path.join(ROOT_DIR, "benchmarks")
+# The Spark steps are shipped as flat --py-files and import each other as top level modules
+sys.path.insert(0, SPARK_SCRIPTS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+@pytest.fixture(scope="session")
+def spark():
+    """
+    Local-mode Spark session with the spark_scripts modules shipped to its Python workers
+    """
+    pytest.importorskip("pyspark")
+    from pyspark.sql import SparkSession
+
+    session = (
+        SparkSession.builder.master("local[2]")
+        .appName("scene-detection-tests")
+        .config("spark.sql.shuffle.partitions", 4)
+        .config("spark.ui.enabled", "false")
+        .getOrCreate()
+    )
+    for module in os.listdir(SPARK_SCRIPTS_DIR):
+        if module.endswith(".py"):
+            session.sparkContext.addPyFile(os.path.join(SPARK_SCRIPTS_DIR, module))
+    yield session
+    session.stop()
@@ -0,0 +1,120 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import dynamo_writer
+
+TABLE_NAME = "scenes"
+
+
+class FakeRow:
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def asDict(self):
+        return self.fields
+
+
+@pytest.fixture
+def client():
+    return boto3.client(
+        "dynamodb",
+        region_name="eu-west-1",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+    )
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(dynamo_writer.time, "sleep", slept.append)
+    return slept
+
+
+def put_requests(num_items):
+    return [
+        {"PutRequest": {"Item": dynamo_writer.to_dynamo_item({"scene_id": f"scene_{i}", "scene_length": i / 10})}}
+        for i in range(num_items)
+    ]
+
+
+def test_to_dynamo_item_leaves_out_nulls():
+    item = dynamo_writer.to_dynamo_item(
+        {"scene_id": "a", "scene_length": 0.5, "end_time": None, "avg": float("nan"), "open": False}
+    )
+    assert item == {"scene_id": {"S": "a"}, "scene_length": {"N": "0.5"}, "open": {"BOOL": False}}
+
+
+def test_unprocessed_items_are_retried_until_written(client, sleeps):
+    requests = put_requests(3)
+    limiter = dynamo_writer.RateLimiter()
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "batch_write_item",
+            {"UnprocessedItems": {TABLE_NAME: requests[1:]}},
+            {"RequestItems": {TABLE_NAME: requests}},
+        )
+        stubber.add_response(
+            "batch_write_item",
+            {"UnprocessedItems": {TABLE_NAME: requests[2:]}},
+            {"RequestItems": {TABLE_NAME: requests[1:]}},
+        )
+        stubber.add_response(
+            "batch_write_item", {"UnprocessedItems": {}}, {"RequestItems": {TABLE_NAME: requests[2:]}}
+        )
+        dynamo_writer.write_batch(client, TABLE_NAME, requests, limiter)
+        stubber.assert_no_pending_responses()
+
+    # halved twice, then increased once the batch was fully written
+    expected_rate = dynamo_writer.INITIAL_RATE * dynamo_writer.RATE_DECREASE ** 2 + dynamo_writer.RATE_INCREASE
+    assert limiter.rate == expected_rate
+
+
+def test_throttling_slows_the_writer_down(client, sleeps):
+    requests = put_requests(2)
+    limiter = dynamo_writer.RateLimiter()
+    with Stubber(client) as stubber:
+        for _ in range(3):
+            stubber.add_client_error(
+                "batch_write_item", service_error_code="ProvisionedThroughputExceededException"
+            )
+        stubber.add_response("batch_write_item", {"UnprocessedItems": {}})
+        dynamo_writer.write_batch(client, TABLE_NAME, requests, limiter)
+        stubber.assert_no_pending_responses()
+
+    assert limiter.rate == dynamo_writer.INITIAL_RATE * dynamo_writer.RATE_DECREASE ** 3 + dynamo_writer.RATE_INCREASE
+
+
+def test_rate_never_drops_below_minimum():
+    limiter = dynamo_writer.RateLimiter()
+    for _ in range(50):
+        limiter.decrease()
+    assert limiter.rate == dynamo_writer.MIN_RATE
+
+
+def test_other_client_errors_are_raised(client, sleeps):
+    with Stubber(client) as stubber:
+        stubber.add_client_error("batch_write_item", service_error_code="ValidationException")
+        with pytest.raises(dynamo_writer.ClientError):
+            dynamo_writer.write_batch(client, TABLE_NAME, put_requests(1), dynamo_writer.RateLimiter())
+
+
+def test_gives_up_after_max_attempts(client, sleeps):
+    requests = put_requests(1)
+    with Stubber(client) as stubber:
+        for _ in range(dynamo_writer.MAX_ATTEMPTS):
+            stubber.add_response("batch_write_item", {"UnprocessedItems": {TABLE_NAME: requests}})
+        with pytest.raises(RuntimeError, match="1 items not written"):
+            dynamo_writer.write_batch(client, TABLE_NAME, requests, dynamo_writer.RateLimiter())
+
+
+def test_partition_is_written_in_batches_of_25(client, sleeps, monkeypatch):
+    monkeypatch.setattr(dynamo_writer.boto3, "client", lambda *args, **kwargs: client)
+    rows = [FakeRow(scene_id=f"scene_{i}", scene_length=i / 10) for i in range(30)]
+    requests = put_requests(30)
+    with Stubber(client) as stubber:
+        stubber.add_response("batch_write_item", {}, {"RequestItems": {TABLE_NAME: requests[:25]}})
+        stubber.add_response("batch_write_item", {}, {"RequestItems": {TABLE_NAME: requests[25:]}})
+        dynamo_writer.write_partition(rows, TABLE_NAME, "eu-west-1")
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,125 @@
+import json
+
+import numpy
+
+from lane_geometry import (
+    corner_lanes,
+    is_object_in_lane,
+    lane_x_at,
+    object_corners,
+    objects_in_lane,
+    parse_lanes,
+)
+
+
+def lane(*points):
+    return numpy.array(points, dtype=float)
+
+
+def box(x, y, width=2.0, height=2.0):
+    return {"x": x, "y": y, "width": width, "height": height}
+
+
+def lane_payload(*lanes):
+    """
+    Synchronized lane topic payload, as written by synchronize_topics.py
+    """
+    lanes_clean = [
+        {"image_points": [{"x": x, "y": y} for x, y in points]} if points is not None else None
+        for points in lanes
+    ]
+    return json.dumps({"lanes_clean": json.dumps(lanes_clean)})
+
+
+# Three vertical lanes at x = 0, 10 and 20 over y in [0, 100]
+VERTICAL_LANES = (
+    lane((0, 0), (0, 100)),
+    lane((10, 0), (10, 100)),
+    lane((20, 0), (20, 100)),
+)
+
+
+def test_object_corners_order():
+    corners = object_corners([box(5, 50, width=4, height=2)])
+    assert corners.tolist() == [[3, 49], [7, 49], [3, 51], [7, 51]]
+
+
+def test_object_between_two_lanes():
+    assert objects_in_lane([box(5, 50)], VERTICAL_LANES) == [(4, [(0, 1)])]
+
+
+def test_object_corners_between_different_lanes():
+    assert objects_in_lane([box(10, 50, width=4)], VERTICAL_LANES) == [(4, [(0, 1), (1, 2)])]
+
+
+def test_object_outside_all_lanes():
+    assert objects_in_lane([box(30, 50), box(-5, 50)], VERTICAL_LANES) == [(0, []), (0, [])]
+    # Corners left of the leftmost lane are outside, the others are in its lane
+    assert objects_in_lane([box(0, 50, width=4)], VERTICAL_LANES) == [(2, [(0, 1)])]
+
+
+def test_lane_keeps_end_point_x_beyond_its_y_range():
+    lanes = (lane((0, 50), (4, 100)), lane((20, 0), (20, 100)))
+    assert lane_x_at(numpy.array([10.0, 75.0, 150.0]), lanes)[:, 0].tolist() == [0, 2, 4]
+    # Extrapolating the lane to y = 10 would put its x at -8 and this corner inside
+    assert corner_lanes(numpy.array([[-2.0, 10.0], [1.0, 10.0]]), lanes).tolist() == [
+        [-1, -1],
+        [0, 1],
+    ]
+
+
+def test_lanes_none_or_without_points():
+    lanes = parse_lanes(
+        lane_payload([(0, 0), (0, 100)], None, [], [(20, 100), (20, 0)])
+    )
+    assert lanes[1] is None and lanes[2] is None
+    # Lane points are sorted by y
+    assert lanes[3][:, 1].tolist() == [0, 100]
+    assert objects_in_lane([box(10, 50)], lanes) == [(4, [(0, 3)])]
+    assert objects_in_lane([box(10, 50)], (None, None, None)) == [(0, [])]
+    assert objects_in_lane([box(10, 50)], VERTICAL_LANES[:1]) == [(0, [])]
+    assert objects_in_lane([box(10, 50)], ()) == [(0, [])]
+    assert objects_in_lane([], VERTICAL_LANES) == []
+
+
+def test_is_object_in_lane_parses_the_payload():
+    payload = lane_payload([(0, 0), (0, 100)], [(10, 0), (10, 100)])
+    assert is_object_in_lane(box(5, 50), payload) == (4, [(0, 1)])
+
+
+def reference_corner_lanes(corners, lanes):
+    """
+    Per corner loop over the lanes, the definition corner_lanes vectorizes
+    """
+    result = []
+    for x, y in corners:
+        lane_xs = sorted(
+            (numpy.interp(y, points[:, 1], points[:, 0]), idx)
+            for idx, points in enumerate(lanes)
+            if points is not None
+        )
+        bracket = [-1, -1]
+        for (left_x, left), (right_x, right) in zip(lane_xs, lane_xs[1:]):
+            if left_x <= x < right_x:
+                bracket = [left, right]
+                break
+        result.append(bracket)
+    return result
+
+
+def test_corner_lanes_matches_per_corner_reference():
+    rng = numpy.random.default_rng(0)
+    for _ in range(20):
+        lanes = []
+        for offset in rng.permutation(5) * 200:
+            if rng.random() < 0.2:
+                lanes.append(None)
+                continue
+            num_points = rng.integers(2, 6)
+            ys = numpy.sort(rng.uniform(0, 720, num_points))
+            xs = offset + rng.uniform(0, 150, num_points)
+            lanes.append(lane(*zip(xs, ys)))
+        corners = numpy.stack([rng.uniform(-100, 1100, 200), rng.uniform(-50, 770, 200)], axis=1)
+        assert corner_lanes(corners, tuple(lanes)).tolist() == reference_corner_lanes(
+            corners, lanes
+        )
@@ -0,0 +1,86 @@
+import pyarrow.dataset as ds
+
+import local_engine
+from common import DETECTIONS_TABLE
+
+
+def read_table(root, table_name, sort_cols):
+    table = ds.dataset(f"{root}/{table_name}", format="parquet", partitioning="hive").to_table()
+    return table.to_pandas().sort_values(sort_cols, ignore_index=True)
+
+
+def test_json_payload_matches_spark_to_json():
+    import pandas as pd
+
+    df = pd.DataFrame(
+        {
+            "Time_ns": [1, 2],
+            "label": ["café", None],
+            "count": [3, 4],
+            "score": [0.5, 0.0001],
+        }
+    )
+    payload = local_engine.create_json_payload(df, non_json_cols=["Time_ns"])["payload"]
+    assert payload.tolist() == [
+        '{"label":"café","count":3,"score":0.5}',
+        '{"count":4,"score":1.0E-4}',
+    ]
+
+
+def test_engines_write_identical_outputs(spark, tmp_path):
+    import benchmark_spark_jobs
+    import detect_scenes
+    import synchronize_topics
+
+    batch_metadata = benchmark_spark_jobs.generate_batch(
+        spark, str(tmp_path), num_bags=2, bag_length_secs=10, num_topics=3
+    )
+    synchronize_topics.main(None, None, f"file://{tmp_path}/spark_sync", spark, batch_metadata=batch_metadata)
+    detect_scenes.main(
+        None,
+        None,
+        f"file://{tmp_path}/spark_sync",
+        f"file://{tmp_path}/spark_scenes",
+        None,
+        spark,
+        batch_metadata=batch_metadata,
+    )
+    local_engine.main(
+        batch_metadata, f"file://{tmp_path}/local_sync", f"file://{tmp_path}/local_scenes"
+    )
+
+    for engine_dir, table_name, sort_cols in [
+        ("sync", "synchronized_topics", ["bag_file", "Time_ns"]),
+        ("scenes", DETECTIONS_TABLE, ["bag_file", "detector_id", "Time_ns"]),
+        ("scenes", "scene_index_by_start", ["bag_file", "detector_id", "start_time_ns"]),
+    ]:
+        spark_df = read_table(tmp_path / f"spark_{engine_dir}", table_name, sort_cols)
+        local_df = read_table(tmp_path / f"local_{engine_dir}", table_name, sort_cols)
+        assert sorted(spark_df.columns) == sorted(local_df.columns)
+        assert len(spark_df) > 0
+        columns = sorted(spark_df.columns)
+        assert spark_df[columns].astype(str).equals(local_df[columns].astype(str)), table_name
+
+
+def test_scene_merged_into_open_island_stays_open():
+    import pandas as pd
+
+    signal = [0, 1, 1, 0, 1, 1]
+    time_ns = [i * 100_000_000 for i in range(len(signal))]
+    df = pd.DataFrame(
+        {
+            "bag_file": "bag",
+            "bag_file_prefix": "prefix",
+            "bag_file_bucket": "bucket",
+            "Time": [t / 1e9 for t in time_ns],
+            "Time_ns": time_ns,
+            "signal": pd.array(signal, dtype="Int64"),
+        }
+    )
+    scenes = local_engine.segment_scenes(
+        df, "signal", min_duration_ns=300_000_000, merge_gap_ns=100_000_000
+    )
+    assert len(scenes) == 1
+    assert scenes.loc[0, "start_time_ns"] == 100_000_000
+    assert pd.isna(scenes.loc[0, "end_time_ns"])
+    assert pd.isna(scenes.loc[0, "end_time"])
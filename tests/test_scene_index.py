@@ -0,0 +1,47 @@
+import pandas as pd
+
+from scene_index import index_files, scenes_longer_than, scenes_overlapping, update_index
+
+
+def index_row(bag_file, start_s, end_s, detector_id="PersonInLane"):
+    start_ns = start_s * 1_000_000_000
+    end_ns = None if end_s is None else end_s * 1_000_000_000
+    return {
+        "bag_file": bag_file,
+        "detector_id": detector_id,
+        "scene_id": f"{bag_file}_{detector_id}_{start_s}",
+        "start_time_ns": start_ns,
+        "end_time_ns": end_ns,
+        "interval_end_ns": end_ns or 100 * 1_000_000_000,
+        "interval_length_ns": (end_ns or 100 * 1_000_000_000) - start_ns,
+        "scene_length": None if end_s is None else float(end_s - start_s),
+    }
+
+
+def test_update_index_keeps_one_sorted_file_per_table(tmp_path):
+    bucket = f"file://{tmp_path}"
+    update_index(bucket, pd.DataFrame([index_row("bag_b", 5, 8), index_row("bag_a", 1, 2)]))
+    # The open scene of bag_b is closed by a rerun, and bag_a gains a scene
+    update_index(bucket, [index_row("bag_b", 5, 9), index_row("bag_a", 30, None)])
+
+    for table_name in ["scene_index_by_start", "scene_index_by_length"]:
+        assert len(index_files(bucket, table_name)[1]) == 1
+
+    scenes = scenes_overlapping(bucket, "bag_a", 0, 100 * 1_000_000_000)
+    assert scenes["scene_id"].tolist() == ["bag_a_PersonInLane_1", "bag_a_PersonInLane_30"]
+    assert pd.isna(scenes.loc[1, "end_time_ns"])
+    assert scenes.loc[0, "start_time_ns"] == 1_000_000_000
+
+    scenes = scenes_longer_than(bucket, "PersonInLane", 0.5)
+    assert scenes["scene_id"].tolist() == ["bag_a_PersonInLane_1", "bag_b_PersonInLane_5"]
+    assert scenes["scene_length"].tolist() == [1.0, 4.0]
+
+
+def test_update_index_drops_scenes_of_recomputed_pairs(tmp_path):
+    bucket = f"file://{tmp_path}"
+    update_index(bucket, [index_row("bag_a", 1, 2), index_row("bag_a", 5, 6, detector_id="Other")])
+    # Detection reran on bag_a and PersonInLane found no scene this time
+    update_index(bucket, [], replaced_pairs=[("bag_a", "PersonInLane")])
+
+    scenes = scenes_overlapping(bucket, "bag_a", 0, 100 * 1_000_000_000)
+    assert scenes["scene_id"].tolist() == ["bag_a_Other_5"]
@@ -0,0 +1,109 @@
+import pyarrow.dataset as ds
+import pytest
+
+pytest.importorskip("pyspark")
+
+import stream_scenes  # noqa: E402
+from common import DETECTIONS_TABLE  # noqa: E402
+
+DETECTIONS_TOPIC = "rgb_right_detections_only"
+LANES_TOPIC = "post_process_lane_points_rgb_front_right"
+
+
+def test_pending_bags_are_ready_when_complete_or_idle():
+    pending = stream_scenes.PendingBags([DETECTIONS_TOPIC, LANES_TOPIC], idle_timeout_ms=1000)
+    pending.add(
+        [
+            ("bag_a", DETECTIONS_TOPIC, "a/detections", 100),
+            ("bag_a", LANES_TOPIC, "a/lanes", 200),
+            ("bag_b", DETECTIONS_TOPIC, "b/detections", 300),
+        ]
+    )
+    assert [item["Name"] for item in pending.pop_ready()] == ["bag_a"]
+
+    # bag_b never gets its lanes, it is processed once the watermark passes its last file
+    pending.add([("bag_c", DETECTIONS_TOPIC, "c/detections", 1500)])
+    assert pending.pop_ready() == [
+        {"Name": "bag_b", "topics": [DETECTIONS_TOPIC], "files": ["b/detections"]}
+    ]
+    assert [item["Name"] for item in pending.pop_ready(flush=True)] == ["bag_c"]
+    assert pending.rows() == []
+
+
+def test_bag_split_across_micro_batches_is_processed_once():
+    pending = stream_scenes.PendingBags([DETECTIONS_TOPIC, LANES_TOPIC], idle_timeout_ms=1000)
+    pending.add([("bag_a", DETECTIONS_TOPIC, "a/detections", 100)])
+    assert pending.pop_ready() == []
+
+    pending.add([("bag_a", LANES_TOPIC, "a/lanes", 200)])
+    items = pending.pop_ready()
+    assert items == [
+        {
+            "Name": "bag_a",
+            "topics": [DETECTIONS_TOPIC, LANES_TOPIC],
+            "files": ["a/detections", "a/lanes"],
+        }
+    ]
+    pending.mark_processed(item["Name"] for item in items)
+
+    # A topic the detectors do not read lands after the bag was processed
+    pending.add([("bag_a", "thermal_detections_only", "a/thermal", 300)])
+    assert pending.pop_ready(flush=True) == []
+    assert pending.rows() == []
+
+
+def test_bags_without_detector_topics_are_skipped():
+    items = [{"Name": "bag_a", "topics": ["vehicle_steering_report"], "files": ["a/steering"]}]
+    assert stream_scenes.process_bags(None, items, "stream-0", None, None, None) == []
+
+
+def test_once_detects_scenes_of_landed_bags(spark, tmp_path):
+    import benchmark_spark_jobs
+
+    batch_metadata = benchmark_spark_jobs.generate_batch(
+        spark, str(tmp_path), num_bags=2, bag_length_secs=20, num_topics=2
+    )
+    scenes_bucket = f"file://{tmp_path}/scenes"
+    stream_scenes.main(
+        spark,
+        f"file://{tmp_path}/bag_parquets",
+        f"file://{tmp_path}/synchronized",
+        scenes_bucket,
+        f"file://{tmp_path}/checkpoint",
+        once=True,
+    )
+
+    detections = ds.dataset(
+        f"{tmp_path}/scenes/{DETECTIONS_TABLE}", format="parquet", partitioning="hive"
+    ).to_table()
+    assert set(detections.column("bag_file").to_pylist()) == {
+        item["Name"] for item in batch_metadata
+    }
+    scene_index = ds.dataset(f"{tmp_path}/scenes/scene_index_by_start", format="parquet").to_table()
+    assert scene_index.num_rows > 0
+    assert set(scene_index.column("bag_file").to_pylist()) <= {item["Name"] for item in batch_metadata}
+
+    # Every landed file was consumed, nothing is left pending for the next run
+    pending = spark.read.parquet(f"file://{tmp_path}/checkpoint/pending_bags")
+    assert pending.count() == 0
+
+    # A late file of a processed bag is dropped by the next run instead of processing the bag again
+    num_detections = detections.num_rows
+    bag_file = batch_metadata[0]["Name"]
+    late_dir = tmp_path / "bag_parquets" / "vehicle_steering_report" / f"bag_file={bag_file}"
+    late_dir.mkdir(parents=True)
+    (late_dir / "late.parquet").write_bytes(b"")
+    stream_scenes.main(
+        spark,
+        f"file://{tmp_path}/bag_parquets",
+        f"file://{tmp_path}/synchronized",
+        scenes_bucket,
+        f"file://{tmp_path}/checkpoint",
+        once=True,
+    )
+    detections = ds.dataset(
+        f"{tmp_path}/scenes/{DETECTIONS_TABLE}", format="parquet", partitioning="hive"
+    ).to_table()
+    assert detections.num_rows == num_detections
+    processed = spark.read.parquet(f"file://{tmp_path}/checkpoint/processed_bags")
+    assert {r.bag_file for r in processed.collect()} == {item["Name"] for item in batch_metadata}
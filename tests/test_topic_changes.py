@@ -0,0 +1,40 @@
+from common import BAG_COLS, NANOS_PER_SEC
+
+
+def dense_frame(df):
+    return df.toPandas().sort_values(["bag_file", "Time_ns"], ignore_index=True)
+
+
+def test_changes_rebuild_the_forward_filled_grid(spark, tmp_path):
+    import benchmark_spark_jobs
+    import synchronize_topics
+    from topic_changes import expand_to_grid, join_by_interval, topic_changes
+
+    batch_metadata = benchmark_spark_jobs.generate_batch(
+        spark, str(tmp_path), num_bags=2, bag_length_secs=10, num_topics=3
+    )
+    topic_data = synchronize_topics.load_and_union_data(spark, batch_metadata)
+    topics = list(topic_data.keys())
+    topic_signals = synchronize_topics.pivot_topic_signals(
+        synchronize_topics.transform_and_union_dfs(topic_data), topics
+    ).persist()
+    # Buckets shorter than the bags, so the fill also carries values across buckets
+    synchronized = dense_frame(
+        synchronize_topics.synchronize_signals(
+            topic_signals, topics=topics, time_bucket_ns=2 * NANOS_PER_SEC
+        )
+    )
+    changes = topic_changes(topic_signals, topics).persist()
+    columns = BAG_COLS + ["Time", "Time_ns"] + [f"{t}_clean" for t in topics]
+    assert len(synchronized) > 0
+
+    expanded = dense_frame(expand_to_grid(changes, topics=topics))
+    assert expanded[columns].equals(synchronized[columns])
+
+    grid = spark.createDataFrame(synchronized[BAG_COLS + ["Time", "Time_ns"]])
+    for topic in topics:
+        grid = join_by_interval(grid, changes, topic)
+    assert dense_frame(grid)[columns].equals(synchronized[columns])
+
+    changes.unpersist()
+    topic_signals.unpersist()